@@ -1,4 +1,3 @@
-import asyncio
 import io
 import os
 import re
@@ -10,11 +9,16 @@ from fastapi import UploadFile, File, HTTPException
 from fastapi.responses import JSONResponse, StreamingResponse
 
 from config.config import settings
-from core.file import pdf_ocr_service, get_status
+from core.doc_cache import doc_cache, sha256_bytes
+from core.executor import image_pool
+from core.file import get_status, serve_cached_document
+from core.manifest import read_manifest, summarize
 from core.marker_pdf import get_marker_pdf, get_marker_pdf_llm
-from core.tools import verify_file_type, read_text_file, process_str, delete_dir, save_file, read_md
+from core.tools import verify_file_type, read_text_file, process_str, delete_dir, save_file, read_md, pdf_page_count
 from schemas.util import ResponseModel
+from services.admission import admission, reject_response
 from services.db_token import db
+from services.job_queue import job_queue
 from services.llm import chat_service
 
 router = APIRouter()
@@ -39,6 +43,8 @@ async def init(user_id: str = ""):
     try:
         # 清空用户缓存文件
         await delete_dir(f"{settings.UPLOAD_DIR}/{user_id}")
+        # 取消尚未开始的任务
+        job_queue.cancel_user(user_id)
         # 清空token记录
         await db.delete_token_record(user_id)
     except Exception as e:
@@ -98,16 +104,40 @@ async def upload_file(file: UploadFile = File(...), user_id: str = Form(...)):
             }
         )
     try:
+        # 已识别过的相同文档直接返回缓存结果，不占用积压额度也不排队
+        if settings.DOC_CACHE_ENABLED:
+            contents = await file.read()
+            await file.seek(0)
+            file_hash = await image_pool.run(sha256_bytes, contents)
+            if doc_cache.contains(doc_cache.key(file_hash)):
+                file_path = await save_file(file, user_id)
+                if await serve_cached_document(file_path, user_id, file_hash) is not None:
+                    return JSONResponse(
+                        status_code=200,
+                        content={
+                            "code": 200,
+                            "message": "success",
+                            "data": {"job_id": None, "doc_cache": "hit"}
+                        }
+                    )
+        # 积压超过阈值时拒绝，由客户端稍后重试
+        estimate = admission.check()
+        if not estimate["admitted"]:
+            return reject_response(estimate)
         # result, mime_type = await pdf_ocr_service(file, user_id)
         # 保存文件
         file_path = await save_file(file, user_id)
-        # 开启异步线程执行任务
-        asyncio.create_task(pdf_ocr_service(file_path, user_id))
+        # 提交到持久化任务队列，由任务消费者执行
+        pages = pdf_page_count(file_path)
+        job_id = job_queue.enqueue("pdf_ocr", user_id, os.path.splitext(file.filename)[0],
+                                   {"file": file_path, "user_id": user_id}, pages)
+        admission.enqueued(pages)
         return JSONResponse(
             status_code=200,
             content={
                 "code": 200,
-                "message": "success"
+                "message": "success",
+                "data": {"job_id": job_id}
             }
         )
     except HTTPException as e:
@@ -139,6 +169,7 @@ async def status(user_id: str = ""):
     :return: \n
     script: \n
         status_type --> 0 未开始（没有该用户的缓存数据），1 进行中(有数据未清洗完成)，2 已完成（上传的文件已全部清洗完成）
+        status --> 各文件的 {"finished": 是否完成, "pages_done": 已完成页数, "pages_total": 总页数}
     """
     if not user_id or user_id == "" or user_id is None or user_id == " ":
         return JSONResponse(
@@ -152,6 +183,14 @@ async def status(user_id: str = ""):
     try:
         # 获取文件状态
         status_type, result = await get_status(user_id)
+        # 各文档的任务状态和页面统计
+        queued = job_queue.user_jobs(user_id)
+        jobs = {}
+        for file_name in result or {}:
+            jobs[file_name] = queued.get(file_name, {})
+            manifest = read_manifest(user_id, file_name)
+            if manifest is not None:
+                jobs[file_name]["skipped_pages"] = manifest.get("skipped_pages", 0)
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -169,7 +208,8 @@ async def status(user_id: str = ""):
             "data": {
                 "user_id": user_id,
                 "status_type": status_type,
-                "status": result
+                "status": result,
+                "jobs": jobs
             }
             # "data": {"status": status}
         }
@@ -246,23 +286,69 @@ async def get_md(user_id: str = "", file_name: str = ""):
     # 读文件
     result = await read_md(file_name, user_id)
     tokens = await db.read_token_record(user_id, file_name)
+    # 各识别路径的页数及节省的token
+    manifest = read_manifest(user_id, file_name)
     return JSONResponse(
         status_code=200,
         content={
             "code": 200,
             "message": "success",
             "data": result,
-            "tokens": tokens
+            "tokens": tokens,
+            "stats": summarize(manifest) if manifest else None
         }
     )
 
 
+async def submit_marker_job(file: UploadFile, user_id: str, use_llm: bool):
+    """
+    保存文件并提交 marker 后台任务，与 /upload 相同：之后通过 /status 查询进度、/getfile 获取结果
+    :param file:
+    :param user_id:
+    :param use_llm: 是否使用基于视觉模型的 marker
+    :return:
+    """
+    try:
+        file_path = await save_file(file, user_id)
+        pages = pdf_page_count(file_path)
+        job_id = job_queue.enqueue("marker_pdf", user_id, os.path.splitext(file.filename)[0],
+                                   {"file": file_path, "user_id": user_id, "use_llm": use_llm}, pages)
+        admission.enqueued(pages)
+        return JSONResponse(
+            status_code=200,
+            content={
+                "code": 200,
+                "message": "success",
+                "data": {"job_id": job_id}
+            }
+        )
+    except HTTPException as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content={
+                "code": e.status_code,
+                "message": e.detail,
+                "data": " "
+            }
+        )
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={
+                "code": 500,
+                "message": f"服务器内部错误: {str(e)}",
+                "data": " "
+            }
+        )
+
+
 @router.post("/marker_pdf", response_model=ResponseModel)
-async def marker_pdf(file: UploadFile = File(...), user_id: str = Form(...)):
+async def marker_pdf(file: UploadFile = File(...), user_id: str = Form(...), async_job: bool = Form(False)):
     """
     使用marker工具，上传文件, 支持PDF \n
     :param file:文件 \n
     :param user_id:用户id \n
+    :param async_job:为 true 时提交为后台任务，立即返回，之后通过 /status 查询进度、/getfile 获取结果 \n
     :return:返回识别的文本内容，格式为markdown \n
     """
     if not file:
@@ -295,8 +381,18 @@ async def marker_pdf(file: UploadFile = File(...), user_id: str = Form(...)):
                 "data": None
             }
         )
+    # 积压超过阈值时拒绝，由客户端稍后重试
+    estimate = admission.check()
+    if not estimate["admitted"]:
+        return reject_response(estimate)
+    if async_job:
+        return await submit_marker_job(file, user_id, use_llm=False)
     try:
-        result = await get_marker_pdf(file, user_id)
+        # 转换期间计入积压
+        pages = pdf_page_count(await file.read())
+        await file.seek(0)
+        with admission.track(pages):
+            result = await get_marker_pdf(file, user_id)
         return JSONResponse(
             status_code=200,
             content={
@@ -326,11 +422,12 @@ async def marker_pdf(file: UploadFile = File(...), user_id: str = Form(...)):
 
 
 @router.post("/marker_pdf_llm", response_model=ResponseModel)
-async def marker_pdf_llm(file: UploadFile = File(...), user_id: str = Form(...)):
+async def marker_pdf_llm(file: UploadFile = File(...), user_id: str = Form(...), async_job: bool = Form(False)):
     """
     使用基于视觉模型的marker工具，上传文件, 支持PDF \n
     :param file:文件 \n
     :param user_id:用户id \n
+    :param async_job:为 true 时提交为后台任务，立即返回，之后通过 /status 查询进度、/getfile 获取结果 \n
     :return:返回识别的文本内容，格式为markdown \n
     """
     if not file:
@@ -363,8 +460,18 @@ async def marker_pdf_llm(file: UploadFile = File(...), user_id: str = Form(...))
                 "data": None
             }
         )
+    # 积压超过阈值时拒绝，由客户端稍后重试
+    estimate = admission.check()
+    if not estimate["admitted"]:
+        return reject_response(estimate)
+    if async_job:
+        return await submit_marker_job(file, user_id, use_llm=True)
     try:
-        result = await get_marker_pdf_llm(file, user_id)
+        # 转换期间计入积压
+        pages = pdf_page_count(await file.read())
+        await file.seek(0)
+        with admission.track(pages):
+            result = await get_marker_pdf_llm(file, user_id)
         return JSONResponse(
             status_code=200,
             content={
@@ -11,6 +11,7 @@ from config.config import settings
 from core.tools import verify_file_type, read_text_file, process_str
 from core.image import image_ocr_service
 from schemas.util import ResponseModel
+from services.admission import admission, reject_response
 from services.llm import chat_service
 
 router = APIRouter()
@@ -42,8 +43,13 @@ async def upload_image(image: UploadFile = File(...)):
                 "data": None
             }
         )
+    # 积压超过阈值时拒绝，由客户端稍后重试
+    estimate = admission.check()
+    if not estimate["admitted"]:
+        return reject_response(estimate)
     try:
         result = await image_ocr_service(image)
+        admission.record(1)
         return JSONResponse(
             status_code=200,
             content={
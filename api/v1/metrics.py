@@ -0,0 +1,192 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from core.doc_cache import doc_cache
+from core.executor import pool_stats
+from core.marker_pdf import marker_pool
+from core.pipeline import pipeline_monitor
+from services.admission import admission
+from services.job_queue import job_queue
+from services.llm import chat_service
+from services.page_cache import page_cache
+from services.scheduler import page_scheduler
+
+router = APIRouter()
+
+
+@router.get("/pipeline")
+async def pipeline_metrics():
+    """
+    查询PDF流水线各阶段的队列深度 \n
+    :return: \n
+    script: \n
+        queue_depth 持续偏高的阶段，其下游阶段即为瓶颈
+    """
+    return JSONResponse(
+        status_code=200,
+        content={
+            "code": 200,
+            "message": "success",
+            "data": pipeline_monitor.snapshot()
+        }
+    )
+
+
+@router.get("/pools")
+async def pools_metrics():
+    """
+    查询CPU执行池的利用率 \n
+    :return: \n
+    script: \n
+        utilization 为最近一分钟内忙碌时间占比，queued 为等待空闲线程/进程的任务数
+    """
+    return JSONResponse(
+        status_code=200,
+        content={
+            "code": 200,
+            "message": "success",
+            "data": pool_stats()
+        }
+    )
+
+
+@router.get("/endpoints")
+async def endpoints_metrics():
+    """
+    查询各vLLM节点的健康状态、在途请求数、延迟和错误计数 \n
+    :return:
+    """
+    return JSONResponse(
+        status_code=200,
+        content={
+            "code": 200,
+            "message": "success",
+            "data": chat_service.balancer.stats()
+        }
+    )
+
+
+@router.get("/limiter")
+async def limiter_metrics():
+    """
+    查询视觉模型自适应并发限制的当前上限及最近的调整记录 \n
+    :return: \n
+    script: \n
+        history.event --> increase 增加，latency 延迟升高减小，overload 超时/429/503减小
+    """
+    return JSONResponse(
+        status_code=200,
+        content={
+            "code": 200,
+            "message": "success",
+            "data": chat_service.limiter.stats()
+        }
+    )
+
+
+@router.get("/requests")
+async def requests_metrics():
+    """
+    查询视觉模型请求的重试和对冲统计 \n
+    :return:
+    """
+    return JSONResponse(
+        status_code=200,
+        content={
+            "code": 200,
+            "message": "success",
+            "data": chat_service.request_stats()
+        }
+    )
+
+
+@router.get("/cache")
+async def cache_metrics():
+    """
+    查询识别结果缓存的命中情况 \n
+    :return:
+    """
+    return JSONResponse(
+        status_code=200,
+        content={
+            "code": 200,
+            "message": "success",
+            "data": {
+                "documents": doc_cache.stats(),
+                "pages": page_cache.stats()
+            }
+        }
+    )
+
+
+@router.get("/jobs")
+async def jobs_metrics():
+    """
+    查询持久化任务队列 \n
+    :return: \n
+    script: \n
+        queue 为各状态的任务数（所有进程），running 为本进程正在执行的任务ID
+    """
+    return JSONResponse(
+        status_code=200,
+        content={
+            "code": 200,
+            "message": "success",
+            "data": job_queue.stats()
+        }
+    )
+
+
+@router.get("/users")
+async def users_metrics():
+    """
+    查询优先级通道和跨用户公平调度的状态 \n
+    :return: \n
+    script: \n
+        lanes 为交互/批量通道的排队数、在途数及等待时间、总耗时的 p50/p95/p99，
+        users 为通道内各用户排队页数、在途页数及最近的排队等待时间
+    """
+    return JSONResponse(
+        status_code=200,
+        content={
+            "code": 200,
+            "message": "success",
+            "data": page_scheduler.stats()
+        }
+    )
+
+
+@router.get("/admission")
+async def admission_metrics():
+    """
+    查询准入控制的积压估算 \n
+    :return: \n
+    script: \n
+        backlog_pages 为所有进程积压的页数，backlog_seconds 按最近吞吐量估算，超过阈值的请求返回 429
+    """
+    return JSONResponse(
+        status_code=200,
+        content={
+            "code": 200,
+            "message": "success",
+            "data": admission.stats()
+        }
+    )
+
+
+@router.get("/marker")
+async def marker_metrics():
+    """
+    查询 marker 模型进程池 \n
+    :return: \n
+    script: \n
+        workers 为各进程的模型加载耗时和内存占用，convert_* 为最近的单次转换耗时
+    """
+    return JSONResponse(
+        status_code=200,
+        content={
+            "code": 200,
+            "message": "success",
+            "data": marker_pool.stats()
+        }
+    )
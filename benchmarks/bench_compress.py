@@ -0,0 +1,105 @@
+"""
+图片压缩引擎基准测试：对比旧的逐步缩放循环与新的搜索式压缩引擎
+
+用法：
+    python -m benchmarks.bench_compress [图片路径 ...]
+不传图片时生成一张300dpi的A4合成页面
+"""
+import io
+import math
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from core.tools import _compress
+
+
+def legacy_resize(image: np.ndarray, target_kb=400, quality=85, min_scale=0.1):
+    """
+    旧版 image_resize_cv / pdf_resize_cv 的压缩流程（不含读文件），统计编码次数
+    :return: (JPEG 字节, 编码次数)
+    """
+    encodes = 0
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+    opencv_image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    _, buffer = cv2.imencode('.jpg', opencv_image, encode_param)
+    encodes += 1
+    original_size_kb = len(buffer) / 1024
+    if original_size_kb <= target_kb:
+        img_byte_arr = io.BytesIO()
+        Image.fromarray(image).save(img_byte_arr, format='JPEG')
+        return img_byte_arr.getvalue(), encodes + 1
+
+    height, width = opencv_image.shape[:2]
+    last_valid_img = None
+    scale = max(math.sqrt(target_kb / original_size_kb) * 0.9, min_scale)
+    attempts = 0
+    while attempts < 10:
+        attempts += 1
+        resized_img = cv2.resize(opencv_image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        _, buffer = cv2.imencode('.jpg', resized_img, encode_param)
+        encodes += 1
+        if len(buffer) / 1024 <= target_kb:
+            last_valid_img = resized_img
+            if scale >= 0.95:
+                break
+            scale = min(scale * 1.05, 1.0)
+        else:
+            if last_valid_img is not None:
+                break
+            scale *= 0.9
+            if scale < min_scale:
+                scale = min_scale
+                last_valid_img = cv2.resize(opencv_image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+                break
+    if last_valid_img is None:
+        last_valid_img = opencv_image
+    # 旧版在找到结果后转回PIL再编码一次
+    processed_img = Image.fromarray(cv2.cvtColor(last_valid_img, cv2.COLOR_BGR2RGB))
+    img_byte_arr = io.BytesIO()
+    processed_img.save(img_byte_arr, format='JPEG', quality=quality)
+    return img_byte_arr.getvalue(), encodes + 1
+
+
+def synthetic_page(seed: int = 0) -> np.ndarray:
+    """
+    生成一张300dpi A4尺寸、带文字和噪点的RGB页面
+    """
+    rng = np.random.default_rng(seed)
+    page = np.full((3508, 2480, 3), 255, dtype=np.uint8)
+    for row in range(120):
+        y = 150 + row * 27
+        cv2.putText(page, f"Line {row} lorem ipsum dolor sit amet 0123456789", (150, y),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (20, 20, 20), 2)
+    noise = rng.integers(0, 12, page.shape, dtype=np.uint8)
+    return cv2.subtract(page, noise)
+
+
+def run(images: list, repeat: int = 3):
+    rows = []
+    for name, image in images:
+        for label, fn in (("legacy", lambda: legacy_resize(image)),
+                          ("engine", lambda: _compress(image)[0:2])):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                buffer, encodes = fn()
+                timings.append((time.perf_counter() - start) * 1000)
+            if isinstance(encodes, dict):
+                encodes = encodes["encodes"]
+            rows.append((name, label, encodes, min(timings), len(buffer) / 1024))
+    print(f"{'image':<24}{'impl':<8}{'encodes':>8}{'ms/image':>12}{'size KB':>10}")
+    for name, label, encodes, ms, size in rows:
+        print(f"{name:<24}{label:<8}{encodes:>8}{ms:>12.1f}{size:>10.1f}")
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:]
+    if paths:
+        inputs = [(path[-24:], np.array(Image.open(path).convert("RGB"))) for path in paths]
+    else:
+        inputs = [("synthetic-a4-300dpi", synthetic_page())]
+    run(inputs)
@@ -0,0 +1,97 @@
+"""
+模型客户端基准测试：对比每次调用新建 AsyncOpenAI 与共享长连接客户端的单次调用开销
+
+启动一个本地模拟的 OpenAI 兼容服务，响应固定内容，只测量客户端侧开销
+用法：
+    python -m benchmarks.bench_llm_client [调用次数] [并发数]
+"""
+import asyncio
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import AsyncOpenAI
+
+from config.config import settings
+
+RESPONSE = json.dumps({
+    "id": "mock",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "mock",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}).encode("utf-8")
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def do_POST(self):
+        MockHandler.connections.add(self.client_address)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def per_call_client(base_url: str):
+    """
+    旧实现：每次调用都新建客户端
+    """
+    client = AsyncOpenAI(api_key="mock", base_url=base_url)
+    await client.chat.completions.create(model="mock", messages=[{"role": "user", "content": "hi"}])
+
+
+async def measure(label: str, call, calls: int, concurrency: int):
+    MockHandler.connections.clear()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await call()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12}{calls:>8}{concurrency:>8}{elapsed / calls * 1000:>12.2f}{len(MockHandler.connections):>14}")
+
+
+async def main(calls: int, concurrency: int):
+    server = start_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    settings.VLLM_API_BASE = base_url
+    settings.VLLM_ENDPOINTS = ""
+    # 延迟导入，使 ChatService 读取到模拟服务地址
+    from services.llm import ChatService
+    service = ChatService()
+    await service.startup()
+
+    async def shared_call():
+        await service.chat("hi", "")
+
+    print(f"{'client':<12}{'calls':>8}{'conc':>8}{'ms/call':>12}{'connections':>14}")
+    await measure("per-call", lambda: per_call_client(base_url), calls, concurrency)
+    await measure("shared", shared_call, calls, concurrency)
+    await service.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    arg_calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    arg_concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    asyncio.run(main(arg_calls, arg_concurrency))
@@ -64,6 +64,40 @@ class Settings:
     DB_PATH = "token.db"
     # 文件上传配置
     UPLOAD_DIR: str = "uploads"
+    # marker 工作进程数、进程池内存预算(MB)、每个进程加载模型后的内存占用估计(MB)
+    # 内存预算是整台机器所有 uvicorn 进程合计的预算，按 WEB_CONCURRENCY 平分到每个进程
+    MARKER_POOL_SIZE: int = int(os.getenv("MARKER_POOL_SIZE", "1"))
+    MARKER_MEMORY_BUDGET_MB: int = int(os.getenv("MARKER_MEMORY_BUDGET_MB", "8192"))
+    # uvicorn --workers 的进程数，uvicorn 也从该环境变量读取默认值
+    WEB_CONCURRENCY: int = int(os.getenv("WEB_CONCURRENCY", "1"))
+    MARKER_WORKER_MEMORY_MB: int = int(os.getenv("MARKER_WORKER_MEMORY_MB", "4096"))
+    # marker 分片转换：每个分片的最少/最多页数
+    MARKER_MIN_SHARD_PAGES: int = int(os.getenv("MARKER_MIN_SHARD_PAGES", "8"))
+    MARKER_MAX_SHARD_PAGES: int = int(os.getenv("MARKER_MAX_SHARD_PAGES", "40"))
+    # 启动时预加载 marker 模型
+    MARKER_PRELOAD: bool = os.getenv("MARKER_PRELOAD", "true").lower() == "true"
+    # 准入控制：积压页数上限、预计排队时间上限(秒)，0 为不限制；超过时返回 429
+    ADMISSION_MAX_BACKLOG_PAGES: int = int(os.getenv("ADMISSION_MAX_BACKLOG_PAGES", "5000"))
+    ADMISSION_MAX_BACKLOG_SECONDS: float = float(os.getenv("ADMISSION_MAX_BACKLOG_SECONDS", "1800"))
+    # 吞吐量统计窗口(秒)，以及还没有吞吐量记录时的经验值(页/秒)
+    ADMISSION_THROUGHPUT_WINDOW: float = float(os.getenv("ADMISSION_THROUGHPUT_WINDOW", "600"))
+    ADMISSION_DEFAULT_PAGES_PER_SECOND: float = float(os.getenv("ADMISSION_DEFAULT_PAGES_PER_SECOND", "0.5"))
+    # 完成页数写入数据库、刷新积压和吞吐量的间隔(秒)
+    ADMISSION_REFRESH_INTERVAL: float = float(os.getenv("ADMISSION_REFRESH_INTERVAL", "5"))
+    # 任务队列数据库，多个 uvicorn 进程共享
+    JOB_DB_PATH: str = os.getenv("JOB_DB_PATH", "jobs.db")
+    # 每个进程同时执行的文档任务数
+    JOB_CONCURRENCY: int = int(os.getenv("JOB_CONCURRENCY", "2"))
+    # 任务心跳间隔(秒)
+    JOB_HEARTBEAT_INTERVAL: float = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "10"))
+    # 心跳超过该时间未更新的任务重新入队(秒)
+    JOB_STALE_AFTER: float = float(os.getenv("JOB_STALE_AFTER", "60"))
+    # 任务最多执行次数
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    # 队列空闲时的轮询间隔(秒)
+    JOB_POLL_INTERVAL: float = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+    # 识别结果缓存目录
+    CACHE_DIR: str = os.getenv("CACHE_DIR", "cache")
     MAX_FILE_SIZE: int = 5 * 1024 * 1024  # 5MB
     # 允许的图片类型
     ALLOWED_IMAGE_TYPES = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
@@ -88,6 +122,17 @@ class Settings:
     VLLM_API_BASE: str = os.getenv("VLLM_API_BASE", "")
     VLLM_MODEL: str = os.getenv("VLLM_MODEL", "")
 
+    # 多个vLLM节点，格式：地址|权重,地址|权重；为空时使用 VLLM_API_BASE
+    VLLM_ENDPOINTS: str = os.getenv("VLLM_ENDPOINTS", "")
+    # 健康检查间隔(秒，0为关闭)、超时(秒)，以及连续失败多少次摘除节点
+    VLLM_HEALTH_CHECK_INTERVAL: float = float(os.getenv("VLLM_HEALTH_CHECK_INTERVAL", "10"))
+    VLLM_HEALTH_CHECK_TIMEOUT: float = float(os.getenv("VLLM_HEALTH_CHECK_TIMEOUT", "5"))
+    VLLM_EJECT_FAILURES: int = int(os.getenv("VLLM_EJECT_FAILURES", "3"))
+    # vLLM连接池：最大连接数、最大空闲长连接数、空闲连接保持时间(秒)
+    VLLM_MAX_CONNECTIONS: int = int(os.getenv("VLLM_MAX_CONNECTIONS", "64"))
+    VLLM_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("VLLM_MAX_KEEPALIVE_CONNECTIONS", "32"))
+    VLLM_KEEPALIVE_EXPIRY: float = float(os.getenv("VLLM_KEEPALIVE_EXPIRY", "60"))
+
     # chat模型
     CHAT_API_KEY: str = os.getenv("CHAT_API_KEY", "")
     CHAT_API_BASE: str = os.getenv("CHAT_API_BASE", "")
@@ -97,8 +142,107 @@ class Settings:
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     OPENAI_MODEL: str = "gpt-4o"
 
+    # 并发配置
+    # 单个PDF任务同时识别的页数
+    PDF_PAGE_CONCURRENCY: int = int(os.getenv("PDF_PAGE_CONCURRENCY", "4"))
+    # 整个进程同时发往视觉模型的请求数上限，自适应限流不会超过该值
+    VLM_MAX_CONCURRENCY: int = int(os.getenv("VLM_MAX_CONCURRENCY", "16"))
+    # 自适应限流：初始/最小并发、拥塞时的乘性减小系数、延迟超过基线多少倍视为拥塞
+    VLM_LIMIT_INITIAL: int = int(os.getenv("VLM_LIMIT_INITIAL", "4"))
+    VLM_LIMIT_MIN: int = int(os.getenv("VLM_LIMIT_MIN", "1"))
+    VLM_LIMIT_BACKOFF: float = float(os.getenv("VLM_LIMIT_BACKOFF", "0.7"))
+    VLM_LIMIT_LATENCY_TOLERANCE: float = float(os.getenv("VLM_LIMIT_LATENCY_TOLERANCE", "2.0"))
+    # 跨用户公平调度：每轮配额、单用户在途上限(0为不限制)、用户权重 "user1|2,user2|3"
+    FAIR_QUANTUM: float = float(os.getenv("FAIR_QUANTUM", "1"))
+    FAIR_USER_MAX_IN_FLIGHT: int = int(os.getenv("FAIR_USER_MAX_IN_FLIGHT", "8"))
+    FAIR_USER_WEIGHTS: str = os.getenv("FAIR_USER_WEIGHTS", "")
+    # 交互请求(单张图片)优先于PDF页面，PDF页面在竞争时至少保有的并发比例
+    BATCH_MIN_SHARE: float = float(os.getenv("BATCH_MIN_SHARE", "0.2"))
+    # 单页识别的截止时间(秒)，包含所有重试
+    VLM_REQUEST_DEADLINE: float = float(os.getenv("VLM_REQUEST_DEADLINE", "600"))
+    # 最多尝试次数，以及指数退避的基础/最大等待时间(秒)
+    VLM_RETRY_ATTEMPTS: int = int(os.getenv("VLM_RETRY_ATTEMPTS", "3"))
+    VLM_RETRY_BACKOFF: float = float(os.getenv("VLM_RETRY_BACKOFF", "1"))
+    VLM_RETRY_BACKOFF_MAX: float = float(os.getenv("VLM_RETRY_BACKOFF_MAX", "30"))
+    # 对冲请求：超过p95耗时后向其他节点重发，对冲请求数不超过总请求数的比例
+    VLM_HEDGE_ENABLED: bool = os.getenv("VLM_HEDGE_ENABLED", "false").lower() == "true"
+    VLM_HEDGE_MAX_RATIO: float = float(os.getenv("VLM_HEDGE_MAX_RATIO", "0.1"))
+    # PDF流水线：压缩阶段并发数，以及每个阶段最多预取的页数
+    PDF_PIPELINE_WORKERS: int = int(os.getenv("PDF_PIPELINE_WORKERS", "4"))
+    PDF_PIPELINE_PREFETCH: int = int(os.getenv("PDF_PIPELINE_PREFETCH", "4"))
+
+    # CPU任务执行池
+    # PDF渲染线程数
+    RENDER_POOL_SIZE: int = int(os.getenv("RENDER_POOL_SIZE", "2"))
+    # 图片压缩/校验池类型(thread/process)及大小
+    IMAGE_POOL_KIND: str = os.getenv("IMAGE_POOL_KIND", "thread")
+    IMAGE_POOL_SIZE: int = int(os.getenv("IMAGE_POOL_SIZE", str(os.cpu_count() or 4)))
+
+    # 发给视觉模型的图片大小上限(KB)
+    IMAGE_TARGET_KB: int = int(os.getenv("IMAGE_TARGET_KB", "400"))
+    # 扫描件整页只有一张嵌入图片时，直接提取原图而不是按300dpi重新渲染
+    PDF_IMAGE_PASSTHROUGH: bool = os.getenv("PDF_IMAGE_PASSTHROUGH", "true").lower() == "true"
+    # 嵌入图片覆盖页面面积的最小比例
+    PDF_IMAGE_PASSTHROUGH_COVERAGE: float = float(os.getenv("PDF_IMAGE_PASSTHROUGH_COVERAGE", "0.9"))
+
+    # 整文档结果缓存：按文件内容+提示词+模型配置寻址，超过容量按LRU淘汰
+    DOC_CACHE_ENABLED: bool = os.getenv("DOC_CACHE_ENABLED", "true").lower() == "true"
+    DOC_CACHE_MAX_MB: int = int(os.getenv("DOC_CACHE_MAX_MB", "1024"))
+
+    # 单页识别缓存：按压缩后的页面图片+提示词+模型寻址
+    PAGE_CACHE_ENABLED: bool = os.getenv("PAGE_CACHE_ENABLED", "true").lower() == "true"
+    PAGE_CACHE_MAX_ENTRIES: int = int(os.getenv("PAGE_CACHE_MAX_ENTRIES", "100000"))
+    # 过期时间(秒)，0 为不过期
+    PAGE_CACHE_TTL: float = float(os.getenv("PAGE_CACHE_TTL", str(30 * 24 * 3600)))
+
+    # 文字层快速通道：文字层可靠的页面不调用视觉模型
+    TEXT_LAYER_ENABLED: bool = os.getenv("TEXT_LAYER_ENABLED", "true").lower() == "true"
+    # 文字层至少包含的字符数
+    TEXT_LAYER_MIN_CHARS: int = int(os.getenv("TEXT_LAYER_MIN_CHARS", "50"))
+    # 图片面积占页面比例超过该值时交给视觉模型
+    TEXT_LAYER_MAX_IMAGE_COVERAGE: float = float(os.getenv("TEXT_LAYER_MAX_IMAGE_COVERAGE", "0.3"))
+    # 逐页引擎路由：表格/框线较多的页面交给 marker；文字层或引擎输出的可信度低于阈值时升级到下一个引擎
+    ROUTER_MARKER_ENABLED: bool = os.getenv("ROUTER_MARKER_ENABLED", "true").lower() == "true"
+    ROUTER_MIN_CONFIDENCE: float = float(os.getenv("ROUTER_MIN_CONFIDENCE", "0.95"))
+    # 线条密度：每万平方点的直线段和矩形数
+    ROUTER_MAX_LINE_DENSITY: float = float(os.getenv("ROUTER_MAX_LINE_DENSITY", "0.5"))
+    # 空白页和近似重复页过滤
+    PAGE_FILTER_ENABLED: bool = os.getenv("PAGE_FILTER_ENABLED", "true").lower() == "true"
+    # 墨迹像素占比不超过该值视为空白页
+    BLANK_PAGE_MAX_INK_RATIO: float = float(os.getenv("BLANK_PAGE_MAX_INK_RATIO", "0.0005"))
+    # 灰度标准差不超过该值视为空白页（纯色分隔页）
+    BLANK_PAGE_MAX_STD: float = float(os.getenv("BLANK_PAGE_MAX_STD", "3"))
+    # 感知哈希汉明距离不超过该值视为重复页
+    DUPLICATE_PAGE_MAX_DISTANCE: int = int(os.getenv("DUPLICATE_PAGE_MAX_DISTANCE", "4"))
+    # pHash相近时，512px灰度缩略图的最大像素差不超过该值才视为重复页
+    DUPLICATE_PAGE_MAX_PIXEL_DIFF: int = int(os.getenv("DUPLICATE_PAGE_MAX_PIXEL_DIFF", "32"))
+    # 多页合并请求：墨迹较少的小页面(幻灯片、小票等)合并为一次多图请求，系统提示词只发送一次
+    VLM_BATCH_ENABLED: bool = os.getenv("VLM_BATCH_ENABLED", "false").lower() == "true"
+    # 每次请求最多合并的页数，以及图片像素总数、估算的图片token总数上限
+    VLM_BATCH_MAX_PAGES: int = int(os.getenv("VLM_BATCH_MAX_PAGES", "4"))
+    VLM_BATCH_MAX_PIXELS: int = int(os.getenv("VLM_BATCH_MAX_PIXELS", str(12000 * 1000)))
+    VLM_BATCH_MAX_TOKENS: int = int(os.getenv("VLM_BATCH_MAX_TOKENS", "16000"))
+    # 合并前每页缩小到的像素上限，约2500个图片token
+    VLM_BATCH_PAGE_MAX_PIXELS: int = int(os.getenv("VLM_BATCH_PAGE_MAX_PIXELS", str(2000 * 1000)))
+    # 每个图片token对应的像素数，用于估算图片token（Qwen2-VL 为 28x28）
+    VLM_PIXELS_PER_TOKEN: int = int(os.getenv("VLM_PIXELS_PER_TOKEN", "784"))
+    # 墨迹像素占比超过该值的页面内容较多，单独识别
+    VLM_BATCH_MAX_INK_RATIO: float = float(os.getenv("VLM_BATCH_MAX_INK_RATIO", "0.05"))
+    # 合并请求的输出token上限
+    VLM_BATCH_MAX_OUTPUT_TOKENS: int = int(os.getenv("VLM_BATCH_MAX_OUTPUT_TOKENS", "8192"))
+    # 等待凑齐一批的最长时间(秒)
+    VLM_BATCH_LINGER: float = float(os.getenv("VLM_BATCH_LINGER", "0.5"))
+    # 估算节省token时每页视觉模型消耗的经验值
+    VLM_TOKENS_PER_PAGE_ESTIMATE: int = int(os.getenv("VLM_TOKENS_PER_PAGE_ESTIMATE", "2000"))
+
     MY_PROMPT_VL_USER = """
 请根据图片中的内容，生成一份格式为Markdown格式的文档
+"""
+
+    # 多页合并请求追加的输出要求，count 为图片数量
+    MY_PROMPT_VL_BATCH = """
+下面共有{count}张图片，每张图片是文档的一页，图片前的 <<<PAGE n>>> 为页码。
+请逐页识别，每一页的输出以单独一行的 <<<PAGE n>>> 开头，按页码顺序输出全部{count}页，不要合并或遗漏页面。
 """
 
     MY_PROMPT_VL_SYSTEM = """
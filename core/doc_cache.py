@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import time
+
+from config.config import settings
+
+
+def file_sha256(file_path: str) -> str:
+    """
+    计算文件内容的SHA-256，在执行池中运行
+    :param file_path:
+    :return:
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sha256_bytes(contents: bytes) -> str:
+    """
+    计算上传内容的SHA-256，与 file_sha256 结果一致，在执行池中运行
+    :param contents:
+    :return:
+    """
+    return hashlib.sha256(contents).hexdigest()
+
+
+def settings_fingerprint() -> str:
+    """
+    影响识别结果的配置：提示词、模型和页面处理参数，任一变化都视为不同的结果
+    """
+    parts = [
+        settings.MY_PROMPT_VL_SYSTEM,
+        settings.MY_PROMPT_VL_USER,
+        settings.VLLM_MODEL,
+        str(settings.IMAGE_TARGET_KB),
+        str(settings.PDF_IMAGE_PASSTHROUGH),
+        str(settings.TEXT_LAYER_ENABLED),
+        str(settings.TEXT_LAYER_MIN_CHARS),
+        str(settings.TEXT_LAYER_MAX_IMAGE_COVERAGE),
+        str(settings.ROUTER_MARKER_ENABLED),
+        str(settings.ROUTER_MIN_CONFIDENCE),
+        str(settings.ROUTER_MAX_LINE_DENSITY),
+        str(settings.PAGE_FILTER_ENABLED),
+        str(settings.BLANK_PAGE_MAX_INK_RATIO),
+        str(settings.BLANK_PAGE_MAX_STD),
+        str(settings.DUPLICATE_PAGE_MAX_DISTANCE),
+        str(settings.DUPLICATE_PAGE_MAX_PIXEL_DIFF),
+    ]
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+class DocumentCache:
+    """
+    按内容寻址的整文档结果缓存，与用户无关；
+    按总大小做LRU淘汰，命中时更新文件修改时间作为最近使用时间
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, file_hash: str) -> str:
+        """
+        :param file_hash: 文件内容的SHA-256
+        :return: 缓存键
+        """
+        return hashlib.sha256(f"{file_hash}:{settings_fingerprint()}".encode("utf-8")).hexdigest()
+
+    def contains(self, key: str) -> bool:
+        """
+        是否有缓存结果，不更新命中统计和最近使用时间
+        :param key:
+        :return:
+        """
+        return os.path.exists(f"{self.cache_dir}/{key}.md") and os.path.exists(f"{self.cache_dir}/{key}.json")
+
+    def get(self, key: str) -> dict or None:
+        """
+        :param key:
+        :return: {"markdown", "total_tokens", "manifest"}，未命中返回 None
+        """
+        md_file = f"{self.cache_dir}/{key}.md"
+        meta_file = f"{self.cache_dir}/{key}.json"
+        try:
+            with open(md_file, 'r', encoding='utf-8') as file:
+                markdown = file.read()
+            with open(meta_file, 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+            now = time.time()
+            os.utime(md_file, (now, now))
+            os.utime(meta_file, (now, now))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        meta["markdown"] = markdown
+        return meta
+
+    def put(self, key: str, markdown: str, total_tokens: int, manifest: dict = None):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        suffix = f".{os.getpid()}.tmp"
+        md_file = f"{self.cache_dir}/{key}.md"
+        meta_file = f"{self.cache_dir}/{key}.json"
+        with open(md_file + suffix, 'w', encoding='utf-8') as file:
+            file.write(markdown)
+        with open(meta_file + suffix, 'w', encoding='utf-8') as file:
+            json.dump({"total_tokens": total_tokens, "manifest": manifest}, file, ensure_ascii=False)
+        # 先替换元数据再替换正文，get 读到正文时元数据一定已存在
+        os.replace(meta_file + suffix, meta_file)
+        os.replace(md_file + suffix, md_file)
+        self.evict()
+
+    def evict(self):
+        """
+        总大小超过上限时，按最近使用时间从旧到新删除
+        """
+        entries = {}
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".tmp"):
+                continue
+            path = f"{self.cache_dir}/{name}"
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            key = os.path.splitext(name)[0]
+            used, size = entries.get(key, (0, 0))
+            entries[key] = (max(used, stat.st_mtime), size + stat.st_size)
+        total = sum(size for _, size in entries.values())
+        for key, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            for ext in (".md", ".json"):
+                try:
+                    os.remove(f"{self.cache_dir}/{key}{ext}")
+                except OSError:
+                    pass
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "max_bytes": self.max_bytes,
+        }
+
+
+doc_cache = DocumentCache(f"{settings.CACHE_DIR}/docs", settings.DOC_CACHE_MAX_MB * 1024 * 1024)
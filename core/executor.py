@@ -0,0 +1,144 @@
+import asyncio
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config.config import settings
+
+
+def _timed(fn, *args):
+    """
+    在工作线程/进程内执行并计时，返回 (结果, 执行耗时)
+    """
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class WorkerPool:
+    """
+    CPU任务执行池，将同步的CPU密集型任务移出事件循环，并统计利用率
+    """
+
+    def __init__(self, name: str, kind: str = "thread", size: int = 4, window: int = 60, initializer=None):
+        """
+        :param name: 池名称
+        :param kind: thread 或 process；process 模式下任务函数和参数必须可序列化
+        :param size: 工作线程/进程数
+        :param window: 利用率统计窗口(秒)
+        :param initializer: 每个工作线程/进程启动时执行一次，用于预加载模型等
+        """
+        self.name = name
+        self.kind = kind
+        self.size = max(1, size)
+        self.window = window
+        self.initializer = initializer
+        self._executor = None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        # 工作进程异常退出(如被OOM杀死)后重建执行器的次数
+        self.restarts = 0
+        self.in_flight = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+        # (完成时间, 执行耗时)，用于计算窗口内利用率
+        self._recent = deque()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn 避免在多线程进程中 fork
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.size,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=self.initializer
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.size,
+                    thread_name_prefix=self.name,
+                    initializer=self.initializer
+                )
+        return self._executor
+
+    async def run(self, fn, *args):
+        """
+        在池中执行同步函数
+        :param fn:
+        :param args:
+        :return: fn 的返回值
+        """
+        self.submitted += 1
+        self.in_flight += 1
+        start = time.perf_counter()
+        executor = self.executor
+        try:
+            result, run_seconds = await asyncio.get_running_loop().run_in_executor(
+                executor, _timed, fn, *args
+            )
+        except BrokenProcessPool:
+            self.failed += 1
+            # 进程池损坏后不能再提交任务，丢弃后下次提交时重建；同一批失败的任务只重建一次
+            if self._executor is executor:
+                print(f"{self.name} 进程池的工作进程异常退出，重建进程池")
+                self.restarts += 1
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        self.busy_seconds += run_seconds
+        self.wait_seconds += max(0.0, time.perf_counter() - start - run_seconds)
+        self._recent.append((time.monotonic(), run_seconds))
+        return result
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        while self._recent and self._recent[0][0] < now - self.window:
+            self._recent.popleft()
+        window_busy = sum(run_seconds for _, run_seconds in self._recent)
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "size": self.size,
+            "in_flight": self.in_flight,
+            "queued": max(0, self.in_flight - self.size),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "restarts": self.restarts,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "avg_wait_ms": round(self.wait_seconds / self.completed * 1000, 2) if self.completed else 0,
+            # 最近窗口内的忙碌时间占总可用时间的比例
+            "utilization": round(min(1.0, window_busy / (self.window * self.size)), 4),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# PDF渲染池：fitz 文档对象不能跨进程，只使用线程
+render_pool = WorkerPool("render", "thread", settings.RENDER_POOL_SIZE)
+# 图片压缩/校验池：可配置为线程或进程
+image_pool = WorkerPool("image", settings.IMAGE_POOL_KIND, settings.IMAGE_POOL_SIZE)
+
+pools = [render_pool, image_pool]
+
+
+def pool_stats() -> list:
+    return [pool.stats() for pool in pools]
+
+
+def shutdown_pools():
+    for pool in pools:
+        pool.shutdown()
@@ -1,15 +1,25 @@
-import io
+import hashlib
 import os
 import re
+import time
 
+import cv2
 import fitz
-from PIL import Image
-from fastapi import UploadFile, HTTPException, File
+import numpy as np
 
 from config.config import settings
-from services.db_token import db
-from services.llm import chat_service
-from core.tools import verify_file_type, read_text_file, image_resize_cv, pdf_resize_cv, get_dir
+from services.admission import admission
+from services.page_batch import PageBatcher
+from services.page_cache import cached_generate_response
+from core.doc_cache import doc_cache, file_sha256, settings_fingerprint
+from core.manifest import read_manifest, write_manifest, read_page, write_page, prune_pages, append_checkpoint, \
+    read_checkpoint, clear_checkpoint, save_result
+from core.executor import render_pool, image_pool
+from core.marker_pdf import marker_pool
+from core.pipeline import Pipeline, Stage
+from core.router import EngineRouter
+from core.text_layer import page_metrics, page_to_markdown, text_confidence
+from core.tools import verify_file_type, read_text_file, compress_image, compress_page, pixmap_to_ndarray, get_dir
 
 
 async def pdf_ocr_service(file: str, user_id: str = ""):
@@ -23,71 +33,406 @@ async def pdf_ocr_service(file: str, user_id: str = ""):
     file_name_with_ext = os.path.basename(file)
     # 分割文件名和扩展名
     file_name, file_ext = os.path.splitext(file_name_with_ext)
-    # 获取用户文件夹
-    user_dir, upload_dir, temp_dir, result_dir = get_dir(user_id)
+    # 相同内容的文档（可能来自其他用户）已识别过时直接使用缓存结果
+    cache_key = None
+    if settings.DOC_CACHE_ENABLED:
+        file_hash = await image_pool.run(file_sha256, file)
+        cached = await serve_cached_document(file, user_id, file_hash)
+        if cached is not None:
+            return cached
+        cache_key = doc_cache.key(file_hash)
+    # 上一个版本的分页结果，按页面指纹复用未变化的页面
+    previous = read_manifest(user_id, file_name) or {}
+    previous_pages = {page["fingerprint"]: page for page in previous.get("pages", []) if "fingerprint" in page}
+    # 本任务上次中断前已完成的页面，从检查点恢复
+    _, checkpoint = read_checkpoint(user_id, file_name)
+    # 以页码为键：内容相同的页面指纹相同，按指纹存放会互相覆盖
+    resumed_pages = {page["page"]: page for page in checkpoint}
+    # 逐页选择识别引擎，上个版本各引擎的可信度作为初始值
+    router = EngineRouter(previous.get("pages", []), settings.ROUTER_MARKER_ENABLED)
     # 用 fitz 打开二进制流
     pdf_document = fitz.open(file)
     print(f"PDF总页数: {len(pdf_document)}")
-    result = ""
-    total_tokens = 0
-    for page_number in range(pdf_document.page_count):
-        # 加载页面，将pdf的每一页转为图片
-        page = pdf_document.load_page(page_number)
-
-        pix = page.get_pixmap(dpi=300)
-
-        img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
-
-        image_file_name = f"{temp_dir}/{file_name}_page_{page_number + 1}.png"
-        print(f"第{str(page_number + 1)}图片信息：{img}")
-        print("开始图片保存")
-        print(f"图片保存路径：{image_file_name}")
-
-        img.save(image_file_name)
-
-        print("图片保存成功")
-        # if not os.path.exists(image_file_name):
-        #     print("临时文件路径错误！")
-        print(f"开始调用图片识别接口处理第{page_number + 1}页")
-        # 调用图片识别接口
-        # 读取文件
-        # image_contents = Image.open(image_file_name)
-        # print(image_contents)
-        # # 使用BytesIO获取图像的二进制数据
-        # bytes_data = io.BytesIO()
-        # image_contents.save(bytes_data, format='PNG')  # 保存图像到BytesIO对象，格式可以是JPEG, PNG等
-        # bytes_data = bytes_data.getvalue()
-        bytes_data = await pdf_resize_cv(image_file_name)
-        tokens, image_md = await chat_service.generate_response(bytes_data)
-        image_md = re.sub(r"```markdown", "", image_md)
-        image_md = re.sub(r"```(?=$|\n)", "", image_md)
-        result += image_md
-        total_tokens = total_tokens + tokens
-
-    # 关闭文档
-    pdf_document.close()
-    # 删掉临时文件
-    if os.path.exists(temp_dir):
-        try:
-            # 遍历文件夹中的所有文件
-            for temp_image_name in os.listdir(temp_dir):
-                temp_image_path = os.path.join(temp_dir, temp_image_name)
-                # 确保是文件而不是子文件夹
-                if os.path.isfile(temp_image_path):
-                    os.remove(temp_image_path)  # 删除文件
-                    print(f"Deleted: {temp_image_path}")
-        except Exception as e:
-            print(f"临时文件处理中出现错误: {e}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"临时文件处理中出现错误: {e}"
+    append_checkpoint(user_id, file_name, {"pages_total": pdf_document.page_count})
+
+    async def rasterize(page_number: int):
+        # fitz 文档不是线程安全的，此阶段只有一个消费者，按页顺序执行
+        return await render_pool.run(_prepare_page, pdf_document, page_number, user_id, file_name, previous_pages,
+                                     resumed_pages, router)
+
+    # 本任务中已送去识别的页面感知哈希，用于发现重复页
+    signatures = []
+    # 墨迹较少的页面合并为多图请求
+    batcher = PageBatcher(user_id) if settings.VLM_BATCH_ENABLED else None
+
+    async def compress(page: dict):
+        if "pix" in page:
+            # 直接使用 pixmap 的像素缓冲区，不落盘、不经过PIL
+            # 数组只是 pix 内存的视图，压缩完成前必须持有 pix 的引用
+            pix = page.pop("pix")
+            source = pixmap_to_ndarray(pix)
+        elif "source" in page:
+            source = page.pop("source")
+            if len(source) > settings.IMAGE_TARGET_KB * 1024:
+                page["mime_type"] = "image/jpeg"
+        else:
+            return page
+        if not settings.PAGE_FILTER_ENABLED:
+            # 原图已满足大小要求时不解码也不重新编码
+            page["image"] = await image_pool.run(compress_image, source, settings.IMAGE_TARGET_KB)
+            return page
+        page["image"], features = await image_pool.run(compress_page, source, settings.IMAGE_TARGET_KB)
+        _filter_page(page, features, signatures)
+        return page
+
+    async def recognize(page: dict):
+        start = time.perf_counter()
+        recognized = page["engine"] == "marker"
+        if page["engine"] == "marker":
+            print(f"开始调用marker处理第{page['page'] + 1}页")
+            try:
+                markdown, tokens = await marker_pool.convert_pages(file, page["page"], page["page"])
+                confidence = text_confidence(markdown)
+                reason = "marker输出可信度低"
+            except Exception as e:
+                # 工作进程崩溃、内存不足或 marker 自身出错时与可信度低一样升级到视觉模型，不让整个任务失败
+                print(f"第{page['page'] + 1}页marker转换失败: {e}")
+                markdown, tokens, confidence, reason = "", 0, 0.0, "marker转换失败"
+            router.observe("marker", confidence)
+            page["tokens"] = tokens
+            if confidence >= settings.ROUTER_MIN_CONFIDENCE:
+                page.update({"markdown": markdown + "\n\n", "confidence": confidence})
+            else:
+                print(f"第{page['page'] + 1}页{reason}({confidence})，改用视觉模型")
+                page.update({"engine": "vlm", "reason": reason, "image_source": "rendered"})
+                page["image"] = await render_pool.run(_render_page_image, file, page["page"])
+        if "image" in page:
+            print(f"开始调用图片识别接口处理第{page['page'] + 1}页")
+            batchable = batcher is not None and page.get("ink_ratio", 0) <= settings.VLM_BATCH_MAX_INK_RATIO
+            if batchable:
+                page["vlm_batch"] = True
+            tokens, image_md, cached_tokens = await cached_generate_response(
+                page.pop("image"), page.pop("mime_type", "image/jpeg"), user_id, batcher=batcher if batchable else None
             )
-    result_file = result_dir + f"/{file_name}.md"
-    with open(result_file, 'w', encoding='utf-8') as file:
-        file.write(result)
-    # 存储token数量
-    await db.create_token_record(user_id, file_name, total_tokens)
-    return result
+            if settings.PAGE_CACHE_ENABLED:
+                page["page_cache"] = "miss" if cached_tokens is None else "hit"
+                page["cached_tokens"] = cached_tokens or 0
+            recognized = recognized or cached_tokens is None
+            image_md = re.sub(r"```markdown", "", image_md)
+            image_md = re.sub(r"```(?=$|\n)", "", image_md)
+            page["tokens"] = page.get("tokens", 0) + tokens
+            page["markdown"] = image_md
+            page["confidence"] = text_confidence(image_md)
+            router.observe("vlm", page["confidence"])
+        page["seconds"] = round(page.get("seconds", 0) + time.perf_counter() - start, 3)
+        # 每页完成即落盘，任务中断后不必重新识别
+        if "markdown" in page and not page.get("reused") and not page.get("resumed"):
+            write_page(user_id, file_name, page["fingerprint"], page["markdown"])
+        append_checkpoint(user_id, file_name, {key: value for key, value in page.items() if key != "markdown"})
+        if recognized:
+            # 只有实际调用了 marker 或视觉模型的页面计入吞吐量，复用、恢复、跳过和文字层页面不计
+            admission.record(1)
+        return page
+
+    prefetch = settings.PDF_PIPELINE_PREFETCH
+    # 合并请求时每个请求需要同时有多页在等待
+    recognize_workers = settings.PDF_PAGE_CONCURRENCY * (settings.VLM_BATCH_MAX_PAGES if batcher else 1)
+    pipeline = Pipeline(f"{user_id}/{file_name}", [
+        Stage("rasterize", rasterize, workers=1, maxsize=prefetch),
+        Stage("compress", compress, workers=settings.PDF_PIPELINE_WORKERS, maxsize=prefetch),
+        Stage("recognize", recognize, workers=recognize_workers, maxsize=prefetch),
+    ])
+    try:
+        pages = await pipeline.run(range(pdf_document.page_count))
+    finally:
+        # 关闭文档
+        pdf_document.close()
+    # 按页码顺序拼接结果
+    pages.sort(key=lambda page: page["page"])
+    for page in pages:
+        if page["engine"] == "duplicate" and "markdown" not in page:
+            page["markdown"] = pages[page["duplicate_of"]]["markdown"]
+            write_page(user_id, file_name, page["fingerprint"], page["markdown"])
+    result = "".join(page["markdown"] for page in pages)
+    total_tokens = sum(page["tokens"] for page in pages)
+    manifest = _build_manifest(file_name, pages)
+    manifest["router"] = router.stats()
+    write_manifest(user_id, file_name, manifest)
+    clear_checkpoint(user_id, file_name)
+    prune_pages(user_id, file_name, {page["fingerprint"] for page in pages})
+    if cache_key is not None:
+        doc_cache.put(cache_key, result, total_tokens, manifest)
+    return await save_result(user_id, file_name, result, total_tokens)
+
+
+async def serve_cached_document(file: str, user_id: str, file_hash: str) -> str or None:
+    """
+    文档缓存命中时直接写入清单和识别结果，不再排队识别
+    :param file:
+    :param user_id:
+    :param file_hash: 文件内容的SHA-256
+    :return: 识别结果，未命中返回 None
+    """
+    cached = doc_cache.get(doc_cache.key(file_hash))
+    if cached is None:
+        return None
+    file_name = os.path.splitext(os.path.basename(file))[0]
+    print(f"文件 {os.path.basename(file)} 命中文档缓存")
+    manifest = cached["manifest"] or {}
+    manifest.update({"file_name": file_name, "doc_cache": "hit"})
+    write_manifest(user_id, file_name, manifest)
+    clear_checkpoint(user_id, file_name)
+    return await save_result(user_id, file_name, cached["markdown"], cached["total_tokens"])
+
+
+def _prepare_page(pdf_document, page_number: int, user_id: str, file_name: str, previous_pages: dict,
+                  resumed_pages: dict, router: EngineRouter) -> dict:
+    """
+    判断页面走哪条识别路径：内容未变化时复用上个版本的结果，否则由路由器在文字层、marker、视觉模型中选择，
+    文字层可用时直接本地生成markdown，输出可信度不足时升级到下一个引擎
+    :param pdf_document:
+    :param page_number:
+    :param user_id:
+    :param file_name: 不带后缀名
+    :param previous_pages: 上个版本的页面记录，以页面指纹为键
+    :param resumed_pages: 本任务中断前已完成的页面记录，以页码为键
+    :param router: 引擎路由器
+    :return: 页面记录，已有结果时带 markdown，需要视觉模型时带 pix(fitz.Pixmap) 或 source(原图字节)
+    """
+    start = time.perf_counter()
+    # 加载页面
+    page = pdf_document.load_page(page_number)
+    fingerprint = _page_fingerprint(pdf_document, page)
+    record = {"page": page_number, "tokens": 0, "fingerprint": fingerprint}
+    resumed = resumed_pages.get(page_number)
+    if resumed is not None and resumed["fingerprint"] == fingerprint:
+        # 检查点中的页面属于本任务，沿用其记录，token已在中断前消耗，照常计入
+        markdown = read_page(user_id, file_name, fingerprint)
+        if markdown is not None:
+            print(f"第{page_number + 1}页已在中断前完成，从检查点恢复")
+            return dict(resumed, resumed=True, markdown=markdown)
+        if resumed["engine"] == "duplicate":
+            # 重复页的结果在所有页面完成后从 duplicate_of 复制
+            print(f"第{page_number + 1}页已在中断前完成，从检查点恢复")
+            return dict(resumed, resumed=True)
+    if fingerprint in previous_pages:
+        markdown = read_page(user_id, file_name, fingerprint)
+        if markdown is not None:
+            print(f"第{page_number + 1}页内容未变化，复用上个版本的结果")
+            record.update({"engine": previous_pages[fingerprint]["engine"], "reused": True, "markdown": markdown})
+            return record
+    engine = "vlm"
+    if settings.TEXT_LAYER_ENABLED:
+        metrics = page_metrics(page)
+        engine, reason = router.route(metrics)
+        record.update(metrics, reason=reason)
+        if engine == "text":
+            markdown = page_to_markdown(page)
+            confidence = text_confidence(markdown)
+            router.observe("text", confidence)
+            if confidence >= settings.ROUTER_MIN_CONFIDENCE:
+                print(f"第{page_number + 1}页使用文字层提取")
+                record.update({"engine": "text", "markdown": markdown, "confidence": confidence})
+                record["seconds"] = round(time.perf_counter() - start, 3)
+                return record
+            engine = router.escalate("text")
+            record["reason"] = "文字层输出可信度低"
+        if engine == "marker":
+            # 由识别阶段调用 marker 进程池处理
+            record["engine"] = "marker"
+            record["seconds"] = round(time.perf_counter() - start, 3)
+            return record
+    record["engine"] = "vlm"
+    # 空白页判断需要知道文字层是否为空
+    record.setdefault("text_chars", len(re.sub(r"\s", "", page.get_text("text"))))
+    if settings.PDF_IMAGE_PASSTHROUGH:
+        embedded = _extract_scan_image(pdf_document, page)
+        if embedded is not None:
+            print(f"第{page_number + 1}页为单张扫描图片，直接使用原图")
+            record["image_source"] = "embedded"
+            record["source"], record["mime_type"] = embedded
+            record["seconds"] = round(time.perf_counter() - start, 3)
+            return record
+    # 将pdf的页面转为图片
+    pix = page.get_pixmap(dpi=300)
+    print(f"第{str(page_number + 1)}页图片信息：{pix.width}x{pix.height}")
+    record["image_source"] = "rendered"
+    record["pix"] = pix
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def _render_page_image(file: str, page_number: int) -> bytes:
+    """
+    marker 输出不合格时，单独打开文档渲染该页并压缩，供视觉模型识别
+    :param file:
+    :param page_number:
+    :return: 压缩后的图片字节
+    """
+    with fitz.open(file) as pdf_document:
+        pix = pdf_document.load_page(page_number).get_pixmap(dpi=300)
+        return compress_image(pixmap_to_ndarray(pix), settings.IMAGE_TARGET_KB)
+
+
+def _filter_page(page: dict, features: dict, signatures: list):
+    """
+    空白页不识别，与本任务已识别页面近似重复的页面复用其结果
+    :param page: 页面记录
+    :param features: 页面特征
+    :param signatures: 已送去识别的 (感知哈希, 页码)
+    :return:
+    """
+    page["ink_ratio"] = features["ink_ratio"]
+    page["std"] = features["std"]
+    # 文字层有内容的页面(如只有一行合计金额、签名)不是空白页
+    blank = features["ink_ratio"] <= settings.BLANK_PAGE_MAX_INK_RATIO or features["std"] <= settings.BLANK_PAGE_MAX_STD
+    if blank and not page.get("text_chars"):
+        print(f"第{page['page'] + 1}页为空白页，跳过识别")
+        page.pop("image")
+        page.update({"engine": "blank", "markdown": ""})
+        return
+    for phash, detail, page_number in signatures:
+        # 同一模板的页面pHash几乎相同，还需逐像素确认，只有数字不同的页面不能复用
+        if bin(phash ^ features["phash"]).count("1") <= settings.DUPLICATE_PAGE_MAX_DISTANCE \
+                and _same_detail(detail, features["detail"]):
+            print(f"第{page['page'] + 1}页与第{page_number + 1}页重复，复用识别结果")
+            page.pop("image")
+            page.update({"engine": "duplicate", "duplicate_of": page_number})
+            return
+    signatures.append((features["phash"], features["detail"], page["page"]))
+
+
+def _same_detail(first: bytes, second: bytes) -> bool:
+    """
+    比较两张缩略图：尺寸相同且最大像素差不超过阈值；
+    平均差会被大片相同的底色稀释，改动一个数字几乎不影响平均值，因此使用最大差
+    :param first: PNG 字节
+    :param second: PNG 字节
+    :return:
+    """
+    if first == second:
+        return True
+    first = cv2.imdecode(np.frombuffer(first, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    second = cv2.imdecode(np.frombuffer(second, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if first is None or second is None or first.shape != second.shape:
+        return False
+    return int(np.max(cv2.absdiff(first, second))) <= settings.DUPLICATE_PAGE_MAX_PIXEL_DIFF
+
+
+def _page_fingerprint(pdf_document, page) -> str:
+    """
+    页面指纹：内容流、引用的图片/表单对象的原始数据、注释和表单域的值与外观流、页面尺寸和旋转，以及影响结果的配置
+    :param pdf_document:
+    :param page:
+    :return:
+    """
+    digest = hashlib.sha256(settings_fingerprint().encode("utf-8"))
+    digest.update(f"{tuple(page.rect)}:{page.rotation}".encode("utf-8"))
+    digest.update(page.read_contents())
+    xrefs = [image[0] for image in page.get_images(full=True)] + [xobject[0] for xobject in page.get_xobjects()]
+    for xref in xrefs:
+        digest.update(pdf_document.xref_stream_raw(xref) or b"")
+    # 注释和表单域不在内容流中，只改了填写值或批注文字的新版本也要重新识别
+    for xref, _, _ in page.annot_xrefs():
+        for key in ("Subtype", "Rect", "FT", "V", "AS", "Contents", "F"):
+            digest.update(f"{key}={pdf_document.xref_get_key(xref, key)[1]}".encode("utf-8"))
+        kind, value = pdf_document.xref_get_key(xref, "AP/N")
+        if kind == "xref":
+            digest.update(pdf_document.xref_stream_raw(int(value.split()[0])) or b"")
+        else:
+            digest.update(value.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _extract_scan_image(pdf_document, page):
+    """
+    页面只有一张铺满且未旋转的JPEG/PNG图片、图片上没有可见文字和矢量图形时，提取原始图片字节
+    :param pdf_document:
+    :param page:
+    :return: (图片字节, mime类型)，不满足条件时返回 None
+    """
+    images = page.get_images(full=True)
+    # 只处理单张图片且没有透明蒙版的页面
+    if len(images) != 1 or images[0][1] != 0 or page.rotation != 0:
+        return None
+    # 图片上叠加的文字或图形不在原图中，需要渲染整页；OCR生成的不可见文字(渲染模式3)除外
+    if _has_visible_text(page) or page.get_drawings():
+        return None
+    xref = images[0][0]
+    infos = page.get_image_info(xrefs=True)
+    if len(infos) != 1 or infos[0]["xref"] != xref:
+        return None
+    a, b, c, d, _, _ = infos[0]["transform"]
+    # 图片被旋转或翻转时，原图方向与页面不一致
+    if b != 0 or c != 0 or a <= 0 or d <= 0:
+        return None
+    coverage = abs(fitz.Rect(infos[0]["bbox"]) & page.rect) / (abs(page.rect) or 1)
+    if coverage < settings.PDF_IMAGE_PASSTHROUGH_COVERAGE:
+        return None
+    image = pdf_document.extract_image(xref)
+    # CMYK等色彩空间的JPEG模型端不一定能解码，交给渲染路径处理
+    if image.get("ext") not in ("jpeg", "png") or image.get("colorspace") not in (1, 3):
+        return None
+    return image["image"], f"image/{image['ext']}"
+
+
+def _has_visible_text(page) -> bool:
+    """
+    页面是否有可见文字，不计渲染模式为3(不可见)的文字
+    :param page:
+    :return:
+    """
+    for span in page.get_texttrace():
+        if span["type"] != 3 and any(not chr(char[0]).isspace() for char in span["chars"]):
+            return True
+    return False
+
+
+def _build_manifest(file_name: str, pages: list) -> dict:
+    """
+    汇总各页的识别路径和token消耗，估算文字层节省的token
+    :param file_name:
+    :param pages: 按页码排序的页面记录
+    :return:
+    """
+    engines = {}
+    for page in pages:
+        engines[page["engine"]] = engines.get(page["engine"], 0) + 1
+    vlm_pages = sum(1 for page in pages if page["engine"] == "vlm" and not page.get("reused"))
+    vlm_tokens = sum(page["tokens"] for page in pages if page["engine"] == "vlm")
+    # 有视觉模型页面时按本任务的平均值估算，否则使用配置的经验值
+    tokens_per_page = vlm_tokens / vlm_pages if vlm_pages else settings.VLM_TOKENS_PER_PAGE_ESTIMATE
+    cache_hits = [page for page in pages if page.get("page_cache") == "hit"]
+    # 各引擎本次实际耗费的时间(秒)，复用的页面不计
+    engine_seconds = {}
+    for page in pages:
+        if "seconds" in page and not page.get("reused"):
+            engine_seconds[page["engine"]] = round(engine_seconds.get(page["engine"], 0) + page["seconds"], 3)
+    return {
+        "file_name": file_name,
+        "pages_total": len(pages),
+        "engines": engines,
+        "engine_seconds": engine_seconds,
+        # 内容未变化、直接复用上个版本结果的页数
+        "reused_pages": sum(1 for page in pages if page.get("reused")),
+        # 空白页和重复页不调用视觉模型
+        "skipped_pages": engines.get("blank", 0) + engines.get("duplicate", 0),
+        # 与其他页面合并为一次多图请求的页数
+        "batched_pages": sum(1 for page in pages if page.get("vlm_batch") and not page.get("reused")),
+        "total_tokens": sum(page["tokens"] for page in pages),
+        "vlm_tokens": vlm_tokens,
+        "estimated_saved_tokens": int(tokens_per_page * (len(pages) - vlm_pages)),
+        # 单页缓存统计，命中页面不消耗token
+        "page_cache": {
+            "hits": len(cache_hits),
+            "misses": sum(1 for page in pages if page.get("page_cache") == "miss"),
+            "saved_tokens": sum(page["cached_tokens"] for page in cache_hits),
+        },
+        "pages": [
+            {key: value for key, value in page.items() if key != "markdown"}
+            for page in pages
+        ],
+    }
 
 
 async def get_status(user_id: str):
@@ -104,16 +449,26 @@ async def get_status(user_id: str):
     # files_list = os.listdir(upload_dir)
     files_list = [os.path.splitext(f)[0] for f in os.listdir(upload_dir)]
 
-    # 结果集
+    # 结果集，只统计md文件，忽略任务目录
     # result_list = os.listdir(result_dir)
-    result_list = [os.path.splitext(f)[0] for f in os.listdir(result_dir)]
-
-    result = dict.fromkeys(files_list, False)
+    result_list = [os.path.splitext(f)[0] for f in os.listdir(result_dir) if f.endswith(".md")]
 
-    for file in result_list:
-        result[file] = True
+    # 已完成的文档以清单为准，进行中的文档以检查点为准
+    result = {}
+    for file in files_list:
+        if file in result_list:
+            manifest = read_manifest(user_id, file) or {}
+            pages_total = manifest.get("pages_total")
+            result[file] = {"finished": True, "pages_done": pages_total, "pages_total": pages_total}
+        else:
+            pages_total, pages = read_checkpoint(user_id, file)
+            result[file] = {
+                "finished": False,
+                "pages_done": len({page["page"] for page in pages}),
+                "pages_total": pages_total,
+            }
 
-    if False in result.values():
+    if not all(item["finished"] for item in result.values()):
         return 1, result
     else:
         return 2, result
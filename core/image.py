@@ -5,8 +5,20 @@ from fastapi import UploadFile, File, HTTPException
 from fastapi.responses import JSONResponse
 
 from config.config import settings
+from core.executor import image_pool
 from core.tools import verify_file_type, image_resize_cv
 from services.llm import chat_service
+from services.page_cache import cached_generate_response
+
+
+def verify_image(image_contents: bytes):
+    """
+    验证图片完整性，在执行池中运行
+    :param image_contents:
+    :return:
+    """
+    img = Image.open(io.BytesIO(image_contents))
+    img.verify()
 
 
 async def image_ocr_service(image: UploadFile = File(...)):
@@ -16,9 +28,7 @@ async def image_ocr_service(image: UploadFile = File(...)):
     image_contents = await image.read()
     # 并验证是否为有效图片
     try:
-        img = Image.open(io.BytesIO(image_contents))
-        # 验证图片完整性
-        img.verify()
+        await image_pool.run(verify_image, image_contents)
     except Exception as e:
         raise HTTPException(
             status_code=400,
@@ -28,7 +38,8 @@ async def image_ocr_service(image: UploadFile = File(...)):
         # print(image_contents)
         # 识别图片
         bytes_data = await image_resize_cv(image_contents)
-        total_tokens, result = await chat_service.generate_response(bytes_data)
+        # 单张图片是用户在等待的交互请求，优先于PDF页面
+        total_tokens, result, _ = await cached_generate_response(bytes_data, lane="interactive")
         return result
     except HTTPException as e:
         raise HTTPException(
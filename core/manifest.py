@@ -0,0 +1,180 @@
+import json
+import os
+import time
+
+from core.tools import get_dir
+from services.db_token import db
+
+
+def get_job_dir(user_id: str, file_name: str) -> str:
+    """
+    单个文档的任务目录，存放清单及分页结果，位于用户的 result 目录下
+    :param user_id:
+    :param file_name: 不带后缀名
+    :return:
+    """
+    user_dir, upload_dir, temp_dir, result_dir = get_dir(user_id)
+    return f"{result_dir}/{file_name}.pages"
+
+
+async def save_result(user_id: str, file_name: str, result: str, total_tokens: int) -> str:
+    """
+    写入识别结果并记录token数量
+    :param user_id:
+    :param file_name: 不带后缀名
+    :param result:
+    :param total_tokens:
+    :return:
+    """
+    user_dir, upload_dir, temp_dir, result_dir = get_dir(user_id)
+    result_file = result_dir + f"/{file_name}.md"
+    with open(result_file, 'w', encoding='utf-8') as file:
+        file.write(result)
+    # 存储token数量
+    await db.create_token_record(user_id, file_name, total_tokens)
+    return result
+
+
+def read_manifest(user_id: str, file_name: str) -> dict or None:
+    """
+    读取任务清单
+    :param user_id:
+    :param file_name: 不带后缀名
+    :return: 清单字典或 None
+    """
+    manifest_file = f"{get_job_dir(user_id, file_name)}/manifest.json"
+    if not os.path.exists(manifest_file):
+        return None
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        print(f"任务清单读取失败: {manifest_file}, {e}")
+        return None
+
+
+def write_manifest(user_id: str, file_name: str, manifest: dict):
+    """
+    原子写入任务清单，先写临时文件再替换，避免读到半个文件
+    :param user_id:
+    :param file_name: 不带后缀名
+    :param manifest:
+    :return:
+    """
+    job_dir = get_job_dir(user_id, file_name)
+    os.makedirs(job_dir, exist_ok=True)
+    manifest["updated_at"] = time.time()
+    manifest_file = f"{job_dir}/manifest.json"
+    temp_file = f"{manifest_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False)
+    os.replace(temp_file, manifest_file)
+
+
+def read_page(user_id: str, file_name: str, fingerprint: str) -> str or None:
+    """
+    读取单页识别结果，分页结果以页面指纹命名
+    :param user_id:
+    :param file_name: 不带后缀名
+    :param fingerprint: 页面指纹
+    :return: markdown 或 None
+    """
+    page_file = f"{get_job_dir(user_id, file_name)}/{fingerprint}.md"
+    if not os.path.exists(page_file):
+        return None
+    with open(page_file, 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def write_page(user_id: str, file_name: str, fingerprint: str, markdown: str):
+    """
+    写入单页识别结果
+    :param user_id:
+    :param file_name: 不带后缀名
+    :param fingerprint: 页面指纹
+    :param markdown:
+    :return:
+    """
+    job_dir = get_job_dir(user_id, file_name)
+    os.makedirs(job_dir, exist_ok=True)
+    page_file = f"{job_dir}/{fingerprint}.md"
+    temp_file = f"{page_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as file:
+        file.write(markdown)
+    os.replace(temp_file, page_file)
+
+
+def prune_pages(user_id: str, file_name: str, keep: set):
+    """
+    删除不再被当前版本引用的分页结果
+    :param user_id:
+    :param file_name: 不带后缀名
+    :param keep: 需要保留的页面指纹
+    :return:
+    """
+    job_dir = get_job_dir(user_id, file_name)
+    if not os.path.exists(job_dir):
+        return
+    for name in os.listdir(job_dir):
+        fingerprint, ext = os.path.splitext(name)
+        if ext == ".md" and fingerprint not in keep:
+            os.remove(f"{job_dir}/{name}")
+
+
+def append_checkpoint(user_id: str, file_name: str, record: dict):
+    """
+    追加一条检查点记录：任务开始时记录总页数，每页完成时记录该页的识别结果（不含markdown）
+    :param user_id:
+    :param file_name: 不带后缀名
+    :param record:
+    :return:
+    """
+    job_dir = get_job_dir(user_id, file_name)
+    os.makedirs(job_dir, exist_ok=True)
+    with open(f"{job_dir}/checkpoint.jsonl", 'a', encoding='utf-8') as file:
+        file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def read_checkpoint(user_id: str, file_name: str):
+    """
+    读取未完成任务的检查点，崩溃时写了一半的最后一行会被忽略
+    :param user_id:
+    :param file_name: 不带后缀名
+    :return: (总页数 或 None, 已完成页面记录列表)
+    """
+    checkpoint_file = f"{get_job_dir(user_id, file_name)}/checkpoint.jsonl"
+    pages_total, pages = None, []
+    if not os.path.exists(checkpoint_file):
+        return pages_total, pages
+    with open(checkpoint_file, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "pages_total" in record:
+                pages_total = record["pages_total"]
+            else:
+                pages.append(record)
+    return pages_total, pages
+
+
+def clear_checkpoint(user_id: str, file_name: str):
+    """
+    任务完成后删除检查点，结果已记录在清单中
+    :param user_id:
+    :param file_name: 不带后缀名
+    :return:
+    """
+    checkpoint_file = f"{get_job_dir(user_id, file_name)}/checkpoint.jsonl"
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+
+def summarize(manifest: dict) -> dict:
+    """
+    清单摘要，去掉逐页明细
+    :param manifest:
+    :return:
+    """
+    return {key: value for key, value in manifest.items() if key != "pages"}
@@ -1,4 +1,12 @@
+import asyncio
+import math
 import os
+import resource
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
 
 from fastapi import UploadFile, HTTPException
 from marker.config.parser import ConfigParser
@@ -7,6 +15,254 @@ from marker.models import create_model_dict
 from marker.output import text_from_rendered
 
 from config.config import settings
+from core.executor import WorkerPool, pools
+from core.manifest import write_manifest, append_checkpoint, clear_checkpoint, save_result
+from core.tools import pdf_page_count
+from services.admission import admission
+
+# marker 工作进程内预加载的模型，只在工作进程中赋值
+_artifact_dict = None
+_worker_info = {}
+
+
+def _load_models():
+    """
+    marker 工作进程初始化：加载一次版面、OCR、识别模型，之后的转换任务复用
+    """
+    global _artifact_dict
+    start = time.perf_counter()
+    # 多个进程并行转换时平分CPU核心，避免 torch 线程互相争抢
+    import torch
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // marker_pool_size()))
+    _artifact_dict = create_model_dict()
+    _worker_info.update({
+        "pid": os.getpid(),
+        "load_seconds": round(time.perf_counter() - start, 2),
+        # ru_maxrss 在 Linux 上单位为KB
+        "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    })
+    print(f"marker 工作进程 {os.getpid()} 模型加载完成，耗时 {_worker_info['load_seconds']}s")
+
+
+def _convert(file_path: str, config: dict = None):
+    """
+    在 marker 工作进程中转换PDF
+    :param file_path:
+    :param config: marker 配置，None 为默认配置；分片转换时带 page_range
+    :return: (markdown, 消耗的token, 转换耗时, 工作进程信息)
+    """
+    start = time.perf_counter()
+    if config is None:
+        converter = PdfConverter(artifact_dict=_artifact_dict)
+    else:
+        config_parser = ConfigParser(config)
+        converter = PdfConverter(
+            config=config_parser.generate_config_dict(),
+            artifact_dict=_artifact_dict,
+            processor_list=config_parser.get_processors(),
+            renderer=config_parser.get_renderer(),
+            llm_service=config_parser.get_llm_service()
+        )
+    rendered = converter(file_path)
+    text, _, images = text_from_rendered(rendered)
+    return text, _llm_tokens(rendered), time.perf_counter() - start, dict(_worker_info)
+
+
+def _llm_tokens(rendered) -> int:
+    """
+    marker 的 LLM 服务把每次调用消耗的token记录在各页的 block_metadata 中
+    :param rendered:
+    :return:
+    """
+    metadata = getattr(rendered, "metadata", None) or {}
+    return sum(
+        (page.get("block_metadata") or {}).get("llm_tokens_used", 0)
+        for page in metadata.get("page_stats", [])
+    )
+
+
+def _ping():
+    return dict(_worker_info)
+
+
+def marker_pool_size() -> int:
+    """
+    工作进程数：配置的进程数与内存预算允许的进程数取较小值；
+    每个 uvicorn 进程各有一个进程池，内存预算按 uvicorn 进程数平分
+    """
+    budget = settings.MARKER_MEMORY_BUDGET_MB // max(1, settings.WEB_CONCURRENCY)
+    by_memory = budget // settings.MARKER_WORKER_MEMORY_MB
+    if by_memory < 1:
+        print(f"marker 内存预算不足: 每个 uvicorn 进程 {budget}MB，至少需要 {settings.MARKER_WORKER_MEMORY_MB}MB")
+    return max(1, min(settings.MARKER_POOL_SIZE, by_memory))
+
+
+class MarkerPool:
+    """
+    预加载模型的 marker 工作进程池：每个进程启动时加载一次模型，转换任务排队复用
+    """
+
+    def __init__(self, size: int, history: int = 100):
+        self.pool = WorkerPool("marker", "process", size, initializer=_load_models)
+        # {pid: 工作进程信息}
+        self.workers = {}
+        # 最近的转换 (文件名, 页数, 分片数, 转换耗时)
+        self.conversions = deque(maxlen=history)
+        # 进程池损坏后的重新预热任务
+        self._warming = None
+
+    async def start(self):
+        """
+        启动时预热：为每个进程提交一个空任务，使所有进程在接收请求前完成模型加载
+        """
+        start = time.perf_counter()
+        infos = await asyncio.gather(*(self.pool.run(_ping) for _ in range(self.pool.size)))
+        for info in infos:
+            self.workers[info["pid"]] = info
+        print(f"marker 进程池预热完成: {len(self.workers)} 个进程, 耗时 {time.perf_counter() - start:.2f}s")
+
+    def shard_ranges(self, pages: int) -> list:
+        """
+        按文档长度和可用进程数切分页码范围：每个进程一个分片，
+        分片过大时切得更细以均衡负载，过小时合并以减少每个分片的固定开销
+        :param pages: 总页数
+        :return: [(起始页, 结束页)]，页码从0开始，包含结束页
+        """
+        workers = min(self.pool.size, os.cpu_count() or 1)
+        if pages <= 0 or workers <= 1:
+            return [(0, pages - 1)] if pages > 0 else []
+        size = math.ceil(pages / workers)
+        size = max(settings.MARKER_MIN_SHARD_PAGES, min(settings.MARKER_MAX_SHARD_PAGES, size))
+        return [(start, min(pages, start + size) - 1) for start in range(0, pages, size)]
+
+    async def convert(self, file_path: str, config: dict = None):
+        """
+        转换PDF，长文档按页码范围分片在多个进程中并行转换，结果按页码顺序合并
+        :param file_path:
+        :param config: marker 配置，None 为默认配置
+        :return: (markdown, 消耗的token)
+        """
+        start = time.perf_counter()
+        pages = pdf_page_count(file_path)
+        ranges = self.shard_ranges(pages)
+        if len(ranges) <= 1:
+            results = [await self._convert(file_path, config)]
+        else:
+            print(f"marker 分片转换: {file_path}, {pages}页, {len(ranges)}个分片")
+            base = config or {"output_format": "markdown"}
+            results = await asyncio.gather(*(
+                self._convert(file_path, dict(base, page_range=f"{first}-{last}"))
+                for first, last in ranges
+            ))
+        seconds = time.perf_counter() - start
+        self.conversions.append((os.path.basename(file_path), pages, max(1, len(ranges)), seconds))
+        print(f"marker 转换完成: {file_path}, 耗时 {seconds:.2f}s")
+        text = "\n\n".join(text.strip("\n") for text, _ in results)
+        return text, sum(tokens for _, tokens in results)
+
+    async def convert_pages(self, file_path: str, first: int, last: int, config: dict = None):
+        """
+        只转换指定页码范围，用于逐页路由
+        :param file_path:
+        :param first: 起始页，从0开始
+        :param last: 结束页，包含
+        :param config: marker 配置，None 为默认配置
+        :return: (markdown, 消耗的token)
+        """
+        base = config or {"output_format": "markdown"}
+        return await self._convert(file_path, dict(base, page_range=f"{first}-{last}"))
+
+    async def _convert(self, file_path: str, config: dict = None):
+        try:
+            text, tokens, seconds, info = await self.pool.run(_convert, file_path, config)
+        except BrokenProcessPool:
+            # 工作进程异常退出，执行器已被丢弃，重新预热新进程池，本次转换失败由调用方处理
+            self.workers.clear()
+            if settings.MARKER_PRELOAD and (self._warming is None or self._warming.done()):
+                self._warming = asyncio.create_task(self._rewarm())
+            raise
+        self.workers[info["pid"]] = info
+        return text, tokens
+
+    async def _rewarm(self):
+        try:
+            await self.start()
+        except Exception as e:
+            print(f"marker 进程池重新预热失败: {e}")
+
+    def stats(self) -> dict:
+        seconds = sorted(item[3] for item in self.conversions)
+        return {
+            "size": self.pool.size,
+            "memory_budget_mb": settings.MARKER_MEMORY_BUDGET_MB,
+            "web_concurrency": settings.WEB_CONCURRENCY,
+            "workers": list(self.workers.values()),
+            "pool": self.pool.stats(),
+            "conversions": len(seconds),
+            "convert_avg_seconds": round(sum(seconds) / len(seconds), 2) if seconds else None,
+            "convert_p95_seconds": round(seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))], 2) if seconds else None,
+            "recent": [
+                {"file": name, "pages": pages, "shards": shards, "seconds": round(value, 2)}
+                for name, pages, shards, value in list(self.conversions)[-10:]
+            ],
+        }
+
+
+marker_pool = MarkerPool(marker_pool_size())
+pools.append(marker_pool.pool)
+
+
+def _llm_config(output_dir: str) -> dict:
+    """
+    基于视觉模型的 marker 配置
+    :param output_dir:
+    :return:
+    """
+    return {
+        # "page_range": "0-15",
+        "output_format": "markdown",
+        "disable_image_extraction": True,
+        "output_dir": output_dir,
+        "use_llm": True,
+        "llm_service": "marker.services.openai.OpenAIService",
+        "openai_base_url": settings.VLLM_API_BASE,
+        "openai_api_key": settings.VLLM_API_KEY,
+        "openai_model": settings.VLLM_MODEL,
+    }
+
+
+async def marker_ocr_service(file: str, user_id: str = "", use_llm: bool = False):
+    """
+    marker 异步任务：由任务队列执行，结果写入用户的 result 目录并记录token
+    :param file: 已保存到 upload 目录的文件路径
+    :param user_id:
+    :param use_llm: 是否使用基于视觉模型的 marker
+    :return:
+    """
+    file_name = os.path.splitext(os.path.basename(file))[0]
+    pages = pdf_page_count(file)
+    # 记录总页数，供 /status 显示进度
+    append_checkpoint(user_id, file_name, {"pages_total": pages})
+    start = time.perf_counter()
+    if use_llm:
+        # 每个任务独立的输出目录，同一用户的并发任务互不影响
+        output_dir = tempfile.mkdtemp(prefix="marker_output_")
+        try:
+            text, tokens = await marker_pool.convert(file, _llm_config(output_dir))
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+    else:
+        text, tokens = await marker_pool.convert(file)
+    write_manifest(user_id, file_name, {
+        "file_name": file_name,
+        "pages_total": pages,
+        "engines": {"marker_llm" if use_llm else "marker": pages},
+        "total_tokens": tokens,
+        "seconds": round(time.perf_counter() - start, 2),
+    })
+    clear_checkpoint(user_id, file_name)
+    admission.record(pages)
+    return await save_result(user_id, file_name, text, tokens)
 
 
 async def get_marker_pdf(file: UploadFile = None, user_id: str = None):
@@ -36,9 +292,10 @@ async def get_marker_pdf(file: UploadFile = None, user_id: str = None):
     #     "ollama_base_url": "127.0.0.1:11434",
     #     "ollama_model": "deepseek-r1:latest",
     # }
-    converter = PdfConverter(artifact_dict=create_model_dict())
-    rendered = converter(file_path)
-    text, _, images = text_from_rendered(rendered)
+    try:
+        text, _ = await marker_pool.convert(file_path)
+    finally:
+        _cleanup(file_path)
 
     print(text)
     return text
@@ -57,54 +314,37 @@ async def get_marker_pdf_llm(file: UploadFile = None, user_id: str = None):
     if not os.path.exists(f'{settings.UPLOAD_DIR}/{user_id}'):
         os.makedirs(f'{settings.UPLOAD_DIR}/{user_id}')
         print(f"用户{user_id}创建临时文件夹成功")
-    if not os.path.exists(f'{settings.UPLOAD_DIR}/{user_id}/output'):
-        os.makedirs(f'{settings.UPLOAD_DIR}/{user_id}/output')
-        print(f"用户{user_id}创建临时文件夹output成功")
     file_path = f"{settings.UPLOAD_DIR}/{user_id}/{file.filename}.pdf"
-    output_dir = f'{settings.UPLOAD_DIR}/{user_id}/output'
     with open(file_path, "wb") as f:
         content = await file.read()
         f.write(content)
-    config = {
-        # "page_range": "0-15",
-        "output_format": "markdown",
-        "disable_image_extraction": True,
-        "output_dir": output_dir,
-        "use_llm": True,
-        "llm_service": "marker.services.openai.OpenAIService",
-        "openai_base_url": settings.VLLM_API_BASE,
-        "openai_api_key": settings.VLLM_API_KEY,
-        "openai_model": settings.VLLM_MODEL,
-    }
-    config_parser = ConfigParser(config)
-    # converter = PdfConverter(artifact_dict=create_model_dict())
-    converter = PdfConverter(
-        config=config_parser.generate_config_dict(),
-        artifact_dict=create_model_dict(),
-        processor_list=config_parser.get_processors(),
-        renderer=config_parser.get_renderer(),
-        llm_service=config_parser.get_llm_service()
-    )
-    rendered = converter(file_path)
-    text, _, images = text_from_rendered(rendered)
+    # 每个请求独立的输出目录，同一用户的并发请求互不影响
+    output_dir = tempfile.mkdtemp(prefix="marker_output_")
+    try:
+        text, _ = await marker_pool.convert(file_path, _llm_config(output_dir))
+    finally:
+        _cleanup(file_path, output_dir)
     print(text)
-    if os.path.exists(f'{settings.UPLOAD_DIR}/{user_id}'):
-        try:
-            # 遍历文件夹中的所有文件
-            for file_name in os.listdir(f'{settings.UPLOAD_DIR}/{user_id}'):
-                file_path = os.path.join(f'{settings.UPLOAD_DIR}/{user_id}', file_name)
-                # 确保是文件而不是子文件夹
-                if os.path.isfile(file_path):
-                    os.remove(file_path)  # 删除文件
-                    print(f"Deleted: {file_path}")
-                for output_name in os.listdir(f'{settings.UPLOAD_DIR}/{user_id}/output'):
-                    output = os.path.join(f'{settings.UPLOAD_DIR}/{user_id}', output_name)
-                    os.remove(file_path)  # 删除文件
-                    print(f"Deleted: {file_path}")
-        except Exception as e:
-            print(f"临时文件处理中出现错误: {e}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"临时文件处理中出现错误: {e}"
-            )
     return text
+
+
+def _cleanup(file_path: str, output_dir: str = None):
+    """
+    删除本次请求的临时PDF和本次请求独立的 marker 输出目录
+    :param file_path:
+    :param output_dir:
+    :return:
+    """
+    try:
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+            print(f"Deleted: {file_path}")
+        if output_dir and os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+            print(f"Deleted: {output_dir}")
+    except Exception as e:
+        print(f"临时文件处理中出现错误: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"临时文件处理中出现错误: {e}"
+        )
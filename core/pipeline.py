@@ -0,0 +1,157 @@
+import asyncio
+import itertools
+import time
+
+
+class Stage:
+    """
+    流水线阶段：一个有界输入队列 + 若干消费者
+    """
+
+    def __init__(self, name: str, handler, workers: int = 1, maxsize: int = 0):
+        """
+        :param name: 阶段名称
+        :param handler: async 处理函数，输入一个元素，返回交给下一阶段的元素
+        :param workers: 消费者数量
+        :param maxsize: 输入队列长度上限，0 为不限
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue = asyncio.Queue(maxsize)
+        self.next = None
+        self.busy = 0
+        self.processed = 0
+        self.busy_seconds = 0.0
+
+    async def _worker(self, pipeline: "Pipeline"):
+        while True:
+            item = await self.queue.get()
+            self.busy += 1
+            start = time.perf_counter()
+            try:
+                output = await self.handler(item)
+                if self.next is not None:
+                    # 下游队列满时在此阻塞，形成背压
+                    await self.next.queue.put(output)
+                else:
+                    pipeline.results.append(output)
+                self.processed += 1
+            except Exception as e:
+                pipeline.fail(e)
+            finally:
+                self.busy_seconds += time.perf_counter() - start
+                self.busy -= 1
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        """
+        阶段状态，队列越深说明下游越慢
+        :return:
+        """
+        return {
+            "stage": self.name,
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "workers": self.workers,
+            "busy": self.busy,
+            "processed": self.processed,
+            "busy_seconds": round(self.busy_seconds, 3),
+        }
+
+
+class Pipeline:
+    """
+    多阶段生产者/消费者流水线，阶段之间通过有界队列衔接
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, name: str, stages: list):
+        self.id = next(self._ids)
+        self.name = name
+        self.stages = stages
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next = next_stage
+        self.results = []
+        self.started_at = None
+        self._error = None
+
+    def fail(self, error: Exception):
+        if self._error is not None and not self._error.done():
+            self._error.set_exception(error)
+
+    async def _drive(self, items):
+        head = self.stages[0]
+        for item in items:
+            await head.queue.put(item)
+        # 按顺序等待各阶段排空
+        for stage in self.stages:
+            await stage.queue.join()
+
+    async def run(self, items) -> list:
+        """
+        执行流水线
+        :param items: 输入第一阶段的元素
+        :return: 最后一个阶段的输出（完成顺序，不保证输入顺序）
+        """
+        self._error = asyncio.get_running_loop().create_future()
+        self.started_at = time.time()
+        pipeline_monitor.register(self)
+        workers = [
+            asyncio.create_task(stage._worker(self))
+            for stage in self.stages
+            for _ in range(stage.workers)
+        ]
+        drive = asyncio.create_task(self._drive(items))
+        try:
+            await asyncio.wait({drive, self._error}, return_when=asyncio.FIRST_COMPLETED)
+            if self._error.done():
+                raise self._error.exception()
+            return self.results
+        finally:
+            drive.cancel()
+            for worker in workers:
+                worker.cancel()
+            if not self._error.done():
+                self._error.cancel()
+            pipeline_monitor.unregister(self)
+
+    def stats(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "stages": [stage.stats() for stage in self.stages],
+        }
+
+
+class PipelineMonitor:
+    """
+    记录当前运行中的流水线，用于观察各阶段队列深度
+    """
+
+    def __init__(self):
+        self.pipelines = {}
+
+    def register(self, pipeline: Pipeline):
+        self.pipelines[pipeline.id] = pipeline
+
+    def unregister(self, pipeline: Pipeline):
+        self.pipelines.pop(pipeline.id, None)
+
+    def snapshot(self) -> dict:
+        """
+        所有运行中流水线的状态，以及按阶段汇总的队列深度
+        :return:
+        """
+        pipelines = [p.stats() for p in self.pipelines.values()]
+        stages = {}
+        for p in pipelines:
+            for stage in p["stages"]:
+                total = stages.setdefault(stage["stage"], {"queue_depth": 0, "busy": 0})
+                total["queue_depth"] += stage["queue_depth"]
+                total["busy"] += stage["busy"]
+        return {"stages": stages, "pipelines": pipelines}
+
+
+pipeline_monitor = PipelineMonitor()
@@ -0,0 +1,67 @@
+from config.config import settings
+
+# 按单页成本从低到高：本地文字层、本地 marker 模型、视觉模型
+ENGINES = ["text", "marker", "vlm"]
+
+
+class EngineRouter:
+    """
+    逐页选择识别引擎：根据文字层字符数与可信度、图片覆盖率、线条密度，
+    以及本任务(和上个版本)中各引擎输出的可信度，选择可能得到合格结果的最便宜的引擎
+    """
+
+    def __init__(self, previous_pages: list = (), marker_enabled: bool = True):
+        """
+        :param previous_pages: 上个版本清单中的页面记录，用于初始化各引擎的可信度
+        :param marker_enabled: 是否可以使用 marker
+        """
+        self.marker_enabled = marker_enabled
+        # 各引擎最近输出的可信度(指数滑动平均)
+        self.confidence = {}
+        for page in previous_pages:
+            if "confidence" in page and page.get("engine") in ENGINES:
+                self.observe(page["engine"], page["confidence"])
+
+    def observe(self, engine: str, confidence: float):
+        """
+        记录某个引擎一页输出的可信度
+        """
+        previous = self.confidence.get(engine)
+        self.confidence[engine] = confidence if previous is None else previous * 0.7 + confidence * 0.3
+
+    def trusted(self, engine: str) -> bool:
+        """
+        该引擎在本任务中近期的输出是否可信，没有记录时视为可信
+        """
+        return self.confidence.get(engine, 1.0) >= settings.ROUTER_MIN_CONFIDENCE
+
+    def escalate(self, engine: str) -> str:
+        """
+        当前引擎不合格时的下一个引擎
+        """
+        for candidate in ENGINES[ENGINES.index(engine) + 1:]:
+            if candidate != "marker" or self.marker_enabled:
+                return candidate
+        return "vlm"
+
+    def route(self, metrics: dict) -> tuple:
+        """
+        :param metrics: page_metrics 的结果
+        :return: (引擎, 原因)
+        """
+        if metrics["text_chars"] < settings.TEXT_LAYER_MIN_CHARS:
+            return "vlm", "文字层为空或过少"
+        if metrics["text_confidence"] < settings.ROUTER_MIN_CONFIDENCE:
+            return "vlm", "文字层编码异常"
+        if metrics["image_coverage"] > settings.TEXT_LAYER_MAX_IMAGE_COVERAGE:
+            return "vlm", "图片占比过高"
+        engine, reason = "text", "文字层可用"
+        if metrics["line_density"] > settings.ROUTER_MAX_LINE_DENSITY and self.marker_enabled:
+            engine, reason = "marker", "表格或框线较多"
+        # 本任务中该引擎近期输出不可信时直接升级，不再逐页试错
+        while engine != "vlm" and not self.trusted(engine):
+            engine, reason = self.escalate(engine), f"{engine}近期输出可信度低"
+        return engine, reason
+
+    def stats(self) -> dict:
+        return {engine: round(value, 4) for engine, value in self.confidence.items()}
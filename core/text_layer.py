@@ -0,0 +1,147 @@
+import re
+from collections import Counter
+
+import fitz
+
+# 中日韩字符，用于决定换行合并时是否插入空格
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+# 正常字符：中日韩文字、字母数字、常见标点及空白
+NORMAL_CHAR_PATTERN = re.compile(
+    r"[\w\s\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef"
+    r"!-/:-@\[-`{-~\u00a0-\u00bf\u2010-\u2027\u2030-\u205e\u2190-\u23ff\u25a0-\u26ff]"
+)
+
+
+def text_confidence(text: str) -> float:
+    """
+    文本可信度：正常字符占非空白字符的比例；
+    字体编码缺失时会提取出替换字符、私用区字符或控制字符，比例随之下降
+    :param text:
+    :return: 0~1，空文本为 0
+    """
+    chars = re.sub(r"\s", "", text)
+    if not chars:
+        return 0.0
+    bad = sum(1 for char in chars if char == "\ufffd" or not NORMAL_CHAR_PATTERN.match(char))
+    return round(1 - bad / len(chars), 4)
+
+
+def page_metrics(page: fitz.Page) -> dict:
+    """
+    页面路由指标：文字层字符数与可信度、文字/图片覆盖率、线条密度
+    :param page:
+    :return:
+    """
+    page_area = abs(page.rect) or 1
+    text = page.get_text("text")
+    text_area = sum(
+        abs(fitz.Rect(block[:4]) & page.rect)
+        for block in page.get_text("blocks")
+        if block[6] == 0
+    )
+    image_area = sum(
+        abs(fitz.Rect(info["bbox"]) & page.rect)
+        for info in page.get_image_info()
+    )
+    # 表格、表单的框线：直线段和矩形的数量，按每万平方点(约A4的1/50)归一化
+    segments = 0
+    for drawing in page.get_drawings():
+        segments += sum(1 for item in drawing["items"] if item[0] in ("l", "re"))
+    return {
+        "text_chars": len(re.sub(r"\s", "", text)),
+        "text_confidence": text_confidence(text),
+        "text_coverage": round(min(text_area / page_area, 1.0), 4),
+        "image_coverage": round(min(image_area / page_area, 1.0), 4),
+        "line_density": round(segments / (page_area / 10000), 2),
+    }
+
+
+def page_to_markdown(page: fitz.Page) -> str:
+    """
+    从文字层生成markdown，按字号推断标题层级，简单表格转为markdown表格
+    :param page:
+    :return:
+    """
+    tables = []
+    try:
+        tables = [(fitz.Rect(table.bbox), table.to_markdown()) for table in page.find_tables().tables]
+    except Exception as e:
+        print(f"第{page.number + 1}页表格识别失败，按普通文本处理: {e}")
+
+    blocks = [
+        block for block in page.get_text("dict", sort=True)["blocks"]
+        if block["type"] == 0
+        and not any(fitz.Rect(block["bbox"]).intersects(rect) for rect, _ in tables)
+    ]
+    body_size = _body_font_size(blocks)
+
+    items = [(rect.y0, rect.x0, markdown.strip()) for rect, markdown in tables]
+    for block in blocks:
+        markdown = _block_to_markdown(block, body_size)
+        if markdown:
+            items.append((block["bbox"][1], block["bbox"][0], markdown))
+    items.sort(key=lambda item: (item[0], item[1]))
+    return "\n\n".join(markdown for _, _, markdown in items) + "\n\n"
+
+
+def _body_font_size(blocks: list) -> float:
+    """
+    正文字号：按字符数加权出现最多的字号
+    """
+    sizes = Counter()
+    for block in blocks:
+        for line in block["lines"]:
+            for span in line["spans"]:
+                sizes[round(span["size"], 1)] += len(span["text"].strip())
+    if not sizes:
+        return 0
+    return sizes.most_common(1)[0][0]
+
+
+def _block_to_markdown(block: dict, body_size: float) -> str:
+    lines = []
+    sizes = []
+    bold = True
+    for line in block["lines"]:
+        text = "".join(span["text"] for span in line["spans"]).strip()
+        if not text:
+            continue
+        lines.append(text)
+        for span in line["spans"]:
+            if span["text"].strip():
+                sizes.append(span["size"])
+                # flags 第5位表示粗体
+                bold = bold and bool(span["flags"] & 16)
+    if not lines:
+        return ""
+    text = lines[0]
+    for line in lines[1:]:
+        # 中文换行直接拼接，西文换行补空格
+        if CJK_PATTERN.match(text[-1]) and CJK_PATTERN.match(line[0]):
+            text += line
+        elif text.endswith("-"):
+            text = text[:-1] + line
+        else:
+            text += " " + line
+    heading = _heading_prefix(max(sizes), body_size, bold, len(text))
+    return f"{heading} {text}" if heading else text
+
+
+def _heading_prefix(size: float, body_size: float, bold: bool, length: int) -> str:
+    """
+    与提示词中的标题层级保持一致：## 为一级标题
+    """
+    if not body_size or length > 100:
+        return ""
+    ratio = size / body_size
+    if ratio >= 1.6:
+        return "##"
+    if ratio >= 1.3:
+        return "###"
+    if ratio >= 1.15:
+        return "####"
+    if bold and length <= 40:
+        return "#####"
+    return ""
@@ -1,4 +1,3 @@
-import io
 import math
 import os
 import re
@@ -6,11 +5,30 @@ import shutil
 from asyncio import sleep
 
 import cv2
+import fitz
 import numpy as np
-from PIL import Image
 from fastapi import UploadFile, HTTPException
 
 from config.config import settings
+from core.executor import image_pool
+
+
+def pdf_page_count(source) -> int:
+    """
+    PDF页数，用于估算积压，无法解析时返回0，由后续处理报告错误
+    :param source: 文件路径或字节
+    :return:
+    """
+    try:
+        if isinstance(source, (bytes, bytearray)):
+            pdf_document = fitz.open(stream=source, filetype="pdf")
+        else:
+            pdf_document = fitz.open(source)
+        with pdf_document:
+            return pdf_document.page_count
+    except Exception as e:
+        print(f"PDF页数读取失败: {e}")
+        return 0
 
 
 def verify_file_type(filename: str, allowed_types: list):
@@ -63,257 +81,217 @@ async def process_str(text: str) -> str:
 async def image_resize_cv(upload_file, target_kb=400, quality=85, min_scale=0.1):
     """
     使用OpenCV降低图片分辨率至目标大小以下
-    :param upload_file: PIL Image对象
+    :param upload_file: 图片字节
     :param target_kb: 目标大小(KB)
     :param quality: 保存质量(1-100)
     :param min_scale: 最小缩放比例
-    :return: 处理后的PIL Image对象
+    :return: 处理后的图片字节
     """
-    img = Image.open(io.BytesIO(upload_file))
-    # 将PIL图像转换为OpenCV格式
-    opencv_image = np.array(img)
-    # 转换颜色空间(RGB->BGR)
-    if len(opencv_image.shape) == 3 and opencv_image.shape[2] == 3:
-        opencv_image = cv2.cvtColor(opencv_image, cv2.COLOR_RGB2BGR)
-
-    # 检查原始大小
-    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
-    # 确保图像是 uint8 类型，并且是 2D/3D 数组
-    if not isinstance(opencv_image, np.ndarray):
-        raise ValueError("输入图像必须是 NumPy 数组")
-
-    if opencv_image.dtype != np.uint8:
-        opencv_image = opencv_image.astype(np.uint8)
-
-    # 如果是带透明通道的图像 (4通道)，则移除 alpha 通道
-    if len(opencv_image.shape) == 3 and opencv_image.shape[2] == 4:
-        opencv_image = cv2.cvtColor(opencv_image, cv2.COLOR_BGRA2BGR)
-
-    # 再次确认 shape 是否有效
-    if len(opencv_image.shape) not in [2, 3]:
-        raise ValueError("图像维度不合法，请确保是灰度图或三通道彩色图")
-    _, buffer = cv2.imencode('.jpg', opencv_image, encode_param)
-    original_size_kb = len(buffer) / 1024
-
-    if original_size_kb <= target_kb:
-        print(f"图片已小于{target_kb}KB，无需调整。大小: {original_size_kb:.2f}KB")
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format=img.format or 'JPEG')
-        img_bytes = img_byte_arr.getvalue()
-        return img_bytes
-
-    print(f"原始图片大小: {original_size_kb:.2f}KB，开始压缩...")
-
-    height, width = opencv_image.shape[:2]
-    scale = 1.0
-    last_valid_img = None
-    last_valid_scale = 1.0
-
-    # progress_bar = st.progress(0)
-    # status_text = st.empty()
-
-    # 计算初始缩放比例
-    initial_scale = math.sqrt(target_kb / original_size_kb)
-    scale = max(initial_scale * 0.9, min_scale)
-
-    max_attempts = 10
-    attempts = 0
-
-    while attempts < max_attempts:
-        attempts += 1
-        progress = attempts / max_attempts
-        # progress_bar.progress(min(progress, 1.0))
-
-        # 计算新尺寸
-        new_width = int(width * scale)
-        new_height = int(height * scale)
-
-        # 缩放图像(使用INTER_AREA插值-最适合缩小)
-        resized_img = cv2.resize(
-            opencv_image,
-            (new_width, new_height),
-            interpolation=cv2.INTER_AREA
-        )
-
-        # 检查大小
-        _, buffer = cv2.imencode('.jpg', resized_img, encode_param)
-        current_size_kb = len(buffer) / 1024
-
-        # status_text.text(f"尝试 {attempts}/{max_attempts}: 比例 {scale:.2f}, 大小 {current_size_kb:.2f}KB")
-
-        if current_size_kb <= target_kb:
-            last_valid_img = resized_img
-            last_valid_scale = scale
-            if scale >= 0.95:
-                break
-            scale = min(scale * 1.05, 1.0)
-        else:
-            if last_valid_img is not None:
-                break
-            scale *= 0.9
-            if scale < min_scale:
-                scale = min_scale
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                resized_img = cv2.resize(
-                    opencv_image,
-                    (new_width, new_height),
-                    interpolation=cv2.INTER_AREA
-                )
-                last_valid_img = resized_img
-                break
-
-    # progress_bar.empty()
-    # status_text.empty()
-
-    if last_valid_img is not None:
-        # 转换回PIL格式
-        if len(last_valid_img.shape) == 3 and last_valid_img.shape[2] == 3:
-            last_valid_img = cv2.cvtColor(last_valid_img, cv2.COLOR_BGR2RGB)
-        processed_img = Image.fromarray(last_valid_img)
-
-        # 计算最终大小
-        img_byte_arr = io.BytesIO()
-        processed_img.save(img_byte_arr, format='JPEG', quality=quality)
-        final_size_kb = len(img_byte_arr.getvalue()) / 1024
+    return await image_pool.run(compress_image, upload_file, target_kb, quality, min_scale)
 
-        print(f"压缩完成! 最终大小: {final_size_kb:.2f}KB, 缩放比例: {last_valid_scale:.2f}")
 
-        return img_byte_arr.getvalue()
-    else:
-        print("无法将图片压缩到目标大小以下")
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format=img.format or 'JPEG')
-        img_bytes = img_byte_arr.getvalue()
-        return img_bytes
+def pixmap_to_ndarray(pix) -> np.ndarray:
+    """
+    将 fitz.Pixmap 的像素缓冲区包装为 numpy 数组，不发生拷贝
+    注意：返回的数组引用 pix 的内存，使用期间需保持 pix 存活
+    :param pix: fitz.Pixmap
+    :return: (height, width, n) 的只读 uint8 数组，通道顺序为 RGB(A)
+    """
+    buffer = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+    return np.lib.stride_tricks.as_strided(
+        buffer,
+        shape=(pix.height, pix.width, pix.n),
+        strides=(pix.stride, pix.n, 1),
+        writeable=False
+    )
 
 
-async def pdf_resize_cv(input_path, target_kb=400, quality=85, min_scale=0.1):
+def compress_image(source, target_kb=400, quality=85, min_scale=0.1, bgr=False) -> bytes:
     """
-    使用OpenCV降低图片分辨率至目标大小以下
-    :param input_path: PIL Image对象路径
+    图片压缩引擎：找到JPEG大小不超过 target_kb 的最大缩放比例
+    :param source: 图片字节 / 图片路径 / numpy 数组(默认RGB通道顺序，可以是只读视图)
     :param target_kb: 目标大小(KB)
     :param quality: 保存质量(1-100)
     :param min_scale: 最小缩放比例
-    :return: 处理后的PIL Image对象
+    :param bgr: numpy 数组是否已是OpenCV的BGR通道顺序
+    :return: JPEG 字节；字节输入本身已满足大小要求时原样返回
     """
-    img = Image.open(input_path)
-    # 将PIL图像转换为OpenCV格式
-    opencv_image = np.array(img)
-    # 转换颜色空间(RGB->BGR)
-    if len(opencv_image.shape) == 3 and opencv_image.shape[2] == 3:
-        opencv_image = cv2.cvtColor(opencv_image, cv2.COLOR_RGB2BGR)
+    buffer, _ = _compress(source, target_kb, quality, min_scale, bgr)
+    return buffer
 
-    # 检查原始大小
-    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
-    # 确保图像是 uint8 类型，并且是 2D/3D 数组
-    if not isinstance(opencv_image, np.ndarray):
-        raise ValueError("输入图像必须是 NumPy 数组")
 
-    if opencv_image.dtype != np.uint8:
-        opencv_image = opencv_image.astype(np.uint8)
+def compress_page(source, target_kb=400, quality=85, min_scale=0.1, bgr=False):
+    """
+    压缩页面图片，同时计算空白页/重复页判断所需的特征，图片只解码一次
+    :return: (JPEG 字节, 页面特征)
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)) and len(source) <= target_kb * 1024:
+        # 已满足大小要求的原图不需要完整解码，按1/4分辨率解码灰度图计算特征
+        thumbnail = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if thumbnail is None:
+            raise ValueError("图片解码失败")
+        return bytes(source), page_features(thumbnail)
+    image, is_bgr = _load_image(source, bgr)
+    features = page_features(image, is_bgr)
+    buffer, _ = _compress(image, target_kb, quality, min_scale, is_bgr)
+    return buffer, features
+
+
+def downscale_image(source: bytes, max_pixels: int, quality=85) -> bytes:
+    """
+    按比例缩小到不超过 max_pixels 像素并编码为JPEG，未超过时原样返回
+    :param source: 图片字节
+    :param max_pixels: 像素数上限
+    :param quality: JPEG质量
+    :return:
+    """
+    image, _ = _load_image(source, True)
+    height, width = image.shape[:2]
+    if width * height <= max_pixels:
+        return bytes(source)
+    scale = (max_pixels / (width * height)) ** 0.5
+    resized = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    _, encoded = cv2.imencode('.jpg', resized, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return encoded.tobytes()
 
-    # 如果是带透明通道的图像 (4通道)，则移除 alpha 通道
-    if len(opencv_image.shape) == 3 and opencv_image.shape[2] == 4:
-        opencv_image = cv2.cvtColor(opencv_image, cv2.COLOR_BGRA2BGR)
 
-    # 再次确认 shape 是否有效
-    if len(opencv_image.shape) not in [2, 3]:
-        raise ValueError("图像维度不合法，请确保是灰度图或三通道彩色图")
-    _, buffer = cv2.imencode('.jpg', opencv_image, encode_param)
-    original_size_kb = len(buffer) / 1024
-
-    if original_size_kb <= target_kb:
-        print(f"图片已小于{target_kb}KB，无需调整。大小: {original_size_kb:.2f}KB")
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format=img.format or 'JPEG')
-        img_bytes = img_byte_arr.getvalue()
-        return img_bytes
-
-    print(f"原始图片大小: {original_size_kb:.2f}KB，开始压缩...")
-
-    height, width = opencv_image.shape[:2]
-    scale = 1.0
-    last_valid_img = None
-    last_valid_scale = 1.0
-
-    # progress_bar = st.progress(0)
-    # status_text = st.empty()
-
-    # 计算初始缩放比例
-    initial_scale = math.sqrt(target_kb / original_size_kb)
-    scale = max(initial_scale * 0.9, min_scale)
-
-    max_attempts = 10
-    attempts = 0
-
-    while attempts < max_attempts:
-        attempts += 1
-        # progress = attempts / max_attempts
-        # progress_bar.progress(min(progress, 1.0))
-
-        # 计算新尺寸
-        new_width = int(width * scale)
-        new_height = int(height * scale)
-
-        # 缩放图像(使用INTER_AREA插值-最适合缩小)
-        resized_img = cv2.resize(
-            opencv_image,
-            (new_width, new_height),
-            interpolation=cv2.INTER_AREA
-        )
+def page_features(image: np.ndarray, bgr: bool = True, width: int = 256, detail_width: int = 512) -> dict:
+    """
+    页面特征：在缩小的灰度图上计算墨迹占比、灰度标准差和64位感知哈希(pHash)，
+    另保留一张较清晰的灰度缩略图(PNG)，用于pHash相近时逐像素确认重复页
+    :param image: 灰度图或彩色图(可以是只读视图)
+    :param bgr: 彩色图是否为BGR通道顺序
+    :param width: 缩小后的宽度
+    :param detail_width: 确认重复页用的缩略图宽度
+    :return: {"ink_ratio", "std", "phash", "detail"}
+    """
+    if len(image.shape) == 3:
+        code = {3: cv2.COLOR_BGR2GRAY if bgr else cv2.COLOR_RGB2GRAY,
+                4: cv2.COLOR_BGRA2GRAY if bgr else cv2.COLOR_RGBA2GRAY}[image.shape[2]]
+        image = cv2.cvtColor(image, code)
+    detail_height = max(1, int(image.shape[0] * detail_width / image.shape[1]))
+    detail = cv2.resize(image, (detail_width, detail_height), interpolation=cv2.INTER_AREA)
+    height = max(1, int(image.shape[0] * width / image.shape[1]))
+    small = cv2.resize(detail, (width, height), interpolation=cv2.INTER_AREA)
+    # 以中位数作为纸张底色，明显偏离底色的像素视为墨迹
+    background = np.median(small)
+    ink_ratio = float(np.mean(np.abs(small.astype(np.int16) - background) > 48))
+    # pHash：32x32 DCT 的左上角 8x8 低频系数（去掉直流分量）与中位数比较
+    dct = cv2.dct(cv2.resize(small, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32))
+    low = dct[:8, :8].flatten()[1:]
+    bits = low > np.median(low)
+    return {
+        "ink_ratio": round(ink_ratio, 5),
+        "std": round(float(np.std(small)), 2),
+        "phash": int("".join("1" if bit else "0" for bit in bits), 2),
+        # 文档页面以大片底色为主，PNG 通常只有几十KB
+        "detail": cv2.imencode(".png", detail)[1].tobytes(),
+    }
+
+
+def _load_image(source, bgr: bool):
+    """
+    统一输入为 numpy 数组
+    :return: (数组, 是否为BGR通道顺序)
+    """
+    if isinstance(source, np.ndarray):
+        return source, bgr
+    if isinstance(source, (str, os.PathLike)):
+        # np.fromfile 兼容中文路径
+        source = np.fromfile(source, dtype=np.uint8)
+    else:
+        source = np.frombuffer(source, dtype=np.uint8)
+    image = cv2.imdecode(source, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("图片解码失败")
+    return image, True
 
-        # 检查大小
-        _, buffer = cv2.imencode('.jpg', resized_img, encode_param)
-        current_size_kb = len(buffer) / 1024
 
-        # status_text.text(f"尝试 {attempts}/{max_attempts}: 比例 {scale:.2f}, 大小 {current_size_kb:.2f}KB")
+def _compress(source, target_kb=400, quality=85, min_scale=0.1, bgr=False):
+    """
+    压缩引擎实现
+    JPEG大小近似满足 size = k * scale^alpha，用已尝试的点拟合 alpha 预测下一个比例，
+    并用 [可行比例, 不可行比例] 区间约束搜索，编码结果直接复用，不再二次编码
+    :return: (JPEG 字节, 统计信息)
+    """
+    stats = {"encodes": 0, "scale": 1.0}
+    target = target_kb * 1024
+    # 已编码的字节在预算内，直接返回
+    if isinstance(source, (bytes, bytearray, memoryview)) and len(source) <= target:
+        return bytes(source), stats
+
+    image, is_bgr = _load_image(source, bgr)
+    if image.dtype != np.uint8:
+        image = image.astype(np.uint8)
+    if len(image.shape) not in [2, 3]:
+        raise ValueError("图像维度不合法，请确保是灰度图或三通道彩色图")
+    height, width = image.shape[:2]
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
 
-        if current_size_kb <= target_kb:
-            last_valid_img = resized_img
-            last_valid_scale = scale
-            if scale >= 0.95:
+    def encode(scale: float) -> np.ndarray:
+        stats["encodes"] += 1
+        resized = image
+        if scale < 1.0:
+            # 先在原始数组上缩小(INTER_AREA最适合缩小)，再做颜色转换，避免整页拷贝
+            resized = cv2.resize(
+                image,
+                (max(1, int(width * scale)), max(1, int(height * scale))),
+                interpolation=cv2.INTER_AREA
+            )
+        if len(resized.shape) == 3 and resized.shape[2] == 4:
+            resized = cv2.cvtColor(resized, cv2.COLOR_BGRA2BGR if is_bgr else cv2.COLOR_RGBA2BGR)
+        elif len(resized.shape) == 3 and resized.shape[2] == 3 and not is_bgr:
+            resized = cv2.cvtColor(resized, cv2.COLOR_RGB2BGR)
+        _, encoded = cv2.imencode('.jpg', resized, encode_param)
+        return encoded
+
+    buffer = encode(1.0)
+    original_size = len(buffer)
+    if original_size <= target:
+        return buffer.tobytes(), stats
+    print(f"原始图片大小: {original_size / 1024:.2f}KB，开始压缩...")
+
+    # 目标取预算的95%，命中 [90%, 100%] 即认为足够接近
+    aim = target * 0.95
+    best_buffer, best_scale = None, 0.0
+    low, high = min_scale, 1.0
+    last_scale, last_size = 1.0, original_size
+    alpha = 2.0
+    scale = max(min_scale, min(1.0, math.sqrt(aim / original_size)))
+    max_attempts = 6
+    for _ in range(max_attempts):
+        buffer = encode(scale)
+        size = len(buffer)
+        # 用相邻两次尝试更新指数，限制在合理范围内
+        if scale != last_scale and size != last_size:
+            alpha = min(3.0, max(1.0, math.log(size / last_size) / math.log(scale / last_scale)))
+        last_scale, last_size = scale, size
+        if size <= target:
+            if scale > best_scale:
+                best_buffer, best_scale = buffer, scale
+            low = scale
+            if size >= target * 0.9 or scale >= 1.0:
                 break
-            scale = min(scale * 1.05, 1.0)
         else:
-            if last_valid_img is not None:
-                break
-            scale *= 0.9
-            if scale < min_scale:
-                scale = min_scale
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                resized_img = cv2.resize(
-                    opencv_image,
-                    (new_width, new_height),
-                    interpolation=cv2.INTER_AREA
-                )
-                last_valid_img = resized_img
+            high = scale
+            if scale <= min_scale:
                 break
-
-    # progress_bar.empty()
-    # status_text.empty()
-
-    if last_valid_img is not None:
-        # 转换回PIL格式
-        if len(last_valid_img.shape) == 3 and last_valid_img.shape[2] == 3:
-            last_valid_img = cv2.cvtColor(last_valid_img, cv2.COLOR_BGR2RGB)
-        processed_img = Image.fromarray(last_valid_img)
-
-        # 计算最终大小
-        img_byte_arr = io.BytesIO()
-        processed_img.save(img_byte_arr, format='JPEG', quality=quality)
-        final_size_kb = len(img_byte_arr.getvalue()) / 1024
-
-        print(f"压缩完成! 最终大小: {final_size_kb:.2f}KB, 缩放比例: {last_valid_scale:.2f}")
-
-        return img_byte_arr.getvalue()
-    else:
+        if high / low <= 1.02:
+            break
+        # 按拟合的指数预测命中目标的比例，并限制在区间内
+        predicted = scale * (aim / size) ** (1 / alpha)
+        scale = min(max(predicted, low * 1.01), high * 0.99)
+
+    if best_buffer is None:
+        # 最小比例仍超出目标，返回最小比例的结果
+        if last_scale > min_scale:
+            best_buffer, best_scale = encode(min_scale), min_scale
+        else:
+            best_buffer, best_scale = buffer, last_scale
         print("无法将图片压缩到目标大小以下")
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format=img.format or 'JPEG')
-        img_bytes = img_byte_arr.getvalue()
-        return img_bytes
+    stats["scale"] = best_scale
+    print(f"压缩完成! 最终大小: {len(best_buffer) / 1024:.2f}KB, 缩放比例: {best_scale:.2f}, 编码次数: {stats['encodes']}")
+    return best_buffer.tobytes(), stats
 
 
 async def save_file(file: UploadFile, user_id: str = "") -> str:
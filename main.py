@@ -1,4 +1,5 @@
 import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
@@ -6,10 +7,42 @@ from fastapi.responses import JSONResponse
 
 from api.v1.api import api_router
 from config.config import settings
+from core.executor import shutdown_pools
+from core.file import pdf_ocr_service
+from core.marker_pdf import marker_pool, marker_ocr_service
+from services.admission import admission
+from services.job_queue import job_queue
+from services.llm import chat_service
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期：启动时初始化资源，关闭时释放
+    """
+    # 创建共享的模型客户端
+    await chat_service.startup()
+    # 启动本进程的任务消费者
+    job_queue.register("pdf_ocr", pdf_ocr_service)
+    job_queue.register("marker_pdf", marker_ocr_service)
+    await job_queue.start()
+    # 定时写入完成页数、刷新准入控制的积压估算
+    await admission.start()
+    # 预加载 marker 模型
+    if settings.MARKER_PRELOAD:
+        await marker_pool.start()
+    yield
+    await job_queue.stop()
+    await admission.stop()
+    await chat_service.close()
+    # 关闭CPU执行池
+    shutdown_pools()
+
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version=settings.VERSION,
+    lifespan=lifespan,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     swagger_js_url="https://unpkg.com/swagger-ui-dist@5/swagger-ui-bundle.js",
     swagger_css_url="https://unpkg.com/swagger-ui-dist@5/swagger-ui.css"
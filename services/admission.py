@@ -0,0 +1,176 @@
+import asyncio
+import math
+import sqlite3
+from contextlib import contextmanager
+
+from fastapi.responses import JSONResponse
+
+from config.config import settings
+from services.job_queue import job_queue
+from services.scheduler import page_scheduler
+
+
+class AdmissionController:
+    """
+    准入控制：根据积压页数和最近的吞吐量估算排队时间，超过阈值时拒绝新请求，
+    由客户端按 Retry-After 稍后重试，而不是让系统中所有任务一起变慢；
+    完成的页数先在内存中累计，队列积压和吞吐量由后台定时在线程中读写SQLite，请求路径上不访问数据库
+    """
+
+    def __init__(self, max_backlog_pages: int, max_backlog_seconds: float, window: float,
+                 default_pages_per_second: float, refresh_interval: float):
+        """
+        :param max_backlog_pages: 积压页数上限，0 为不限制
+        :param max_backlog_seconds: 预计排队时间上限(秒)，0 为不限制
+        :param window: 吞吐量统计窗口(秒)
+        :param default_pages_per_second: 还没有吞吐量记录时使用的经验值
+        :param refresh_interval: 写入完成页数、刷新积压和吞吐量的间隔(秒)
+        """
+        self.max_backlog_pages = max_backlog_pages
+        self.max_backlog_seconds = max_backlog_seconds
+        self.window = window
+        self.default_pages_per_second = default_pages_per_second
+        self.refresh_interval = refresh_interval
+        # 本进程同步执行中的页数（marker 转换）
+        self.local_pages = 0
+        # 已完成、尚未写入数据库的页数
+        self.pending_pages = 0
+        # 最近一次刷新得到的队列积压页数和吞吐量 (页/秒, 样本覆盖的秒数)
+        self.queued_pages = 0
+        self.throughput = (0, 0)
+        self.admitted = 0
+        self.rejected = 0
+        self._task = None
+
+    @contextmanager
+    def track(self, pages: int):
+        """
+        同步执行的请求在执行期间计入积压，完成后计入吞吐量
+        :param pages:
+        """
+        self.local_pages += pages
+        try:
+            yield
+        finally:
+            self.local_pages -= pages
+        self.record(pages)
+
+    def record(self, pages: int):
+        """
+        记录完成的页数，由后台定时写入
+        """
+        self.pending_pages += pages
+
+    def enqueued(self, pages: int):
+        """
+        新提交的任务在下次刷新前先计入积压，避免刷新间隔内的突发请求全部被接收
+        """
+        self.queued_pages += pages
+
+    async def refresh(self):
+        """
+        写入累计的完成页数，并重新读取所有进程的积压和吞吐量
+        """
+        pages, self.pending_pages = self.pending_pages, 0
+        try:
+            if pages:
+                await asyncio.to_thread(job_queue.record_pages, pages, self.window)
+            self.queued_pages = await asyncio.to_thread(job_queue.backlog_pages)
+            self.throughput = await asyncio.to_thread(job_queue.throughput, self.window)
+        except sqlite3.Error as e:
+            print(f"准入控制统计刷新失败: {e}")
+
+    async def start(self):
+        await self.refresh()
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # 退出前写入剩余的完成页数
+        if self.pending_pages:
+            await self.refresh()
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+    def estimate(self) -> dict:
+        """
+        :return: 积压页数、吞吐量和预计排队时间
+        """
+        interactive = page_scheduler.lanes["interactive"]
+        # 批量通道的页面属于队列中执行中的任务，已计入任务积压
+        backlog_pages = (self.queued_pages + self.local_pages
+                         + interactive.total_in_flight + sum(len(queue) for queue in interactive.queues.values()))
+        pages_per_second, span = self.throughput
+        if not pages_per_second:
+            pages_per_second = self.default_pages_per_second
+        return {
+            "backlog_pages": round(backlog_pages, 1),
+            "pages_per_second": round(pages_per_second, 3),
+            "throughput_span": round(span, 1),
+            "backlog_seconds": round(backlog_pages / pages_per_second, 1),
+        }
+
+    def check(self) -> dict:
+        """
+        判断是否接收新请求
+        :return: 估算结果，带 admitted 和拒绝时的 retry_after(秒)
+        """
+        estimate = self.estimate()
+        over_pages = self.max_backlog_pages and estimate["backlog_pages"] > self.max_backlog_pages
+        over_seconds = self.max_backlog_seconds and estimate["backlog_seconds"] > self.max_backlog_seconds
+        if not over_pages and not over_seconds:
+            self.admitted += 1
+            estimate["admitted"] = True
+            return estimate
+        # 按当前吞吐量，积压降回阈值以内所需的时间
+        limit_pages = min(
+            self.max_backlog_pages or math.inf,
+            (self.max_backlog_seconds or math.inf) * estimate["pages_per_second"],
+        )
+        excess = estimate["backlog_pages"] - limit_pages
+        self.rejected += 1
+        estimate["admitted"] = False
+        estimate["retry_after"] = max(1, math.ceil(excess / estimate["pages_per_second"]))
+        return estimate
+
+    def stats(self) -> dict:
+        return {
+            "max_backlog_pages": self.max_backlog_pages,
+            "max_backlog_seconds": self.max_backlog_seconds,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            **self.estimate(),
+        }
+
+
+def reject_response(estimate: dict) -> JSONResponse:
+    """
+    积压超过阈值时的 429 响应
+    :param estimate: check() 的结果
+    :return:
+    """
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(estimate["retry_after"])},
+        content={
+            "code": 429,
+            "message": f"服务繁忙，当前积压约{int(estimate['backlog_pages'])}页，"
+                       f"预计排队{int(estimate['backlog_seconds'])}秒，请{estimate['retry_after']}秒后重试",
+            "data": estimate
+        }
+    )
+
+
+admission = AdmissionController(
+    settings.ADMISSION_MAX_BACKLOG_PAGES,
+    settings.ADMISSION_MAX_BACKLOG_SECONDS,
+    settings.ADMISSION_THROUGHPUT_WINDOW,
+    settings.ADMISSION_DEFAULT_PAGES_PER_SECOND,
+    settings.ADMISSION_REFRESH_INTERVAL,
+)
@@ -0,0 +1,190 @@
+import asyncio
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import httpx
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError
+
+from config.config import settings
+
+# 这些错误说明节点本身不可用，连续出现时摘除节点
+ENDPOINT_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError)
+
+
+def parse_endpoints(value: str) -> list:
+    """
+    解析节点配置，格式：地址|权重,地址|权重，权重缺省为1
+    :param value: 例如 http://10.0.0.1:8000/v1|2,http://10.0.0.2:8000/v1
+    :return: [(地址, 权重)]
+    """
+    endpoints = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, weight = item.partition("|")
+        endpoints.append((url.strip(), float(weight) if weight.strip() else 1.0))
+    return endpoints
+
+
+class Endpoint:
+    """
+    单个vLLM节点：长连接客户端 + 在途请求数 + 延迟和错误统计
+    """
+
+    def __init__(self, base_url: str, weight: float = 1.0, api_key: str = ""):
+        self.base_url = base_url
+        self.weight = max(weight, 0.01)
+        self.api_key = api_key
+        self.client = None
+        self.in_flight = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+        self.last_error = None
+        self.latencies = deque(maxlen=200)
+
+    def startup(self):
+        if self.client is not None:
+            return
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.VLLM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.VLLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.VLLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(180, connect=10),
+        )
+        self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http_client)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    def load(self) -> float:
+        """
+        按权重折算的在途请求数，越小越优先
+        """
+        return (self.in_flight + 1) / self.weight
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+
+        return {
+            "base_url": self.base_url,
+            "weight": self.weight,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "consecutive_failures": self.consecutive_failures,
+            "ejections": self.ejections,
+            "last_error": self.last_error,
+            "latency_p50_ms": percentile(0.5),
+            "latency_p95_ms": percentile(0.95),
+        }
+
+
+class LoadBalancer:
+    """
+    多节点负载均衡：选择加权在途请求数最少的健康节点，
+    连续失败的节点被摘除，由后台健康检查恢复
+    """
+
+    def __init__(self, endpoints: list):
+        self.endpoints = endpoints
+        self._health_task = None
+
+    async def startup(self):
+        for endpoint in self.endpoints:
+            endpoint.startup()
+        if self._health_task is None and settings.VLLM_HEALTH_CHECK_INTERVAL > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for endpoint in self.endpoints:
+            await endpoint.close()
+
+    def pick(self, exclude=()) -> Endpoint:
+        """
+        选择节点
+        :param exclude: 不参与选择的节点（如对冲请求要避开的节点）
+        :return:
+        """
+        candidates = [e for e in self.endpoints if e.healthy and e not in exclude]
+        if not candidates:
+            # 全部被摘除时仍然尝试，避免整体不可用
+            candidates = [e for e in self.endpoints if e not in exclude] or self.endpoints
+        lowest = min(e.load() for e in candidates)
+        return random.choice([e for e in candidates if e.load() == lowest])
+
+    @asynccontextmanager
+    async def use(self, exclude=()):
+        """
+        占用一个节点执行请求，并记录延迟和错误
+        :param exclude:
+        :return: Endpoint
+        """
+        endpoint = self.pick(exclude)
+        endpoint.startup()
+        endpoint.in_flight += 1
+        endpoint.requests += 1
+        start = time.perf_counter()
+        try:
+            yield endpoint
+        except ENDPOINT_ERRORS as e:
+            self._record_failure(endpoint, e)
+            raise
+        except Exception as e:
+            # 参数错误等请求级错误不影响节点健康状态
+            endpoint.errors += 1
+            endpoint.last_error = str(e)[:200]
+            raise
+        else:
+            endpoint.latencies.append(time.perf_counter() - start)
+            endpoint.consecutive_failures = 0
+        finally:
+            endpoint.in_flight -= 1
+
+    def _record_failure(self, endpoint: Endpoint, error: Exception):
+        endpoint.errors += 1
+        endpoint.consecutive_failures += 1
+        endpoint.last_error = str(error)[:200]
+        if endpoint.healthy and endpoint.consecutive_failures >= settings.VLLM_EJECT_FAILURES:
+            endpoint.healthy = False
+            endpoint.ejections += 1
+            print(f"节点 {endpoint.base_url} 连续失败{endpoint.consecutive_failures}次，已摘除")
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(settings.VLLM_HEALTH_CHECK_INTERVAL)
+            await asyncio.gather(*(self._check(endpoint) for endpoint in self.endpoints))
+
+    async def _check(self, endpoint: Endpoint):
+        """
+        通过 /models 接口检查节点，成功则恢复被摘除的节点
+        """
+        try:
+            endpoint.startup()
+            await endpoint.client.models.list(timeout=settings.VLLM_HEALTH_CHECK_TIMEOUT)
+        except Exception as e:
+            self._record_failure(endpoint, e)
+            return
+        endpoint.consecutive_failures = 0
+        if not endpoint.healthy:
+            endpoint.healthy = True
+            print(f"节点 {endpoint.base_url} 健康检查通过，已恢复")
+
+    def stats(self) -> list:
+        return [endpoint.stats() for endpoint in self.endpoints]
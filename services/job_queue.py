@@ -0,0 +1,388 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+from config.config import settings
+
+
+class JobQueue:
+    """
+    持久化任务队列：任务记录在SQLite中，进程重启或崩溃后不会丢失；
+    每个进程按配置的并发数启动消费者，认领任务并定期更新心跳，
+    心跳超时的任务（所在进程已退出）重新入队，多个 uvicorn 进程共享同一个队列
+    """
+
+    def __init__(self, db_path: str, concurrency: int, heartbeat_interval: float,
+                 stale_after: float, max_attempts: int, poll_interval: float):
+        """
+        :param db_path: 队列数据库路径
+        :param concurrency: 每个进程同时执行的任务数
+        :param heartbeat_interval: 心跳间隔(秒)
+        :param stale_after: 心跳超过该时间未更新视为进程已退出(秒)
+        :param max_attempts: 最多执行次数，超过后标记为失败
+        :param poll_interval: 空闲时轮询间隔(秒)
+        """
+        self.db_path = db_path
+        self.concurrency = concurrency
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.handlers = {}
+        # 本进程正在执行的任务 {job_id: asyncio.Task}
+        self.running = {}
+        self.completed = 0
+        self.failed = 0
+        self.requeued = 0
+        self._tasks = []
+        self._wakeup = None
+        self._initialized = False
+
+    def connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        # 手动控制事务，认领任务时用 BEGIN IMMEDIATE 加写锁
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT,
+                    user_id TEXT,
+                    file_name TEXT,
+                    payload TEXT,
+                    status TEXT DEFAULT 'queued',
+                    attempts INTEGER DEFAULT 0,
+                    worker TEXT,
+                    error TEXT,
+                    created_at REAL,
+                    started_at REAL,
+                    heartbeat_at REAL,
+                    finished_at REAL
+                )
+            """)
+            # 旧版本的队列没有页数列
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if "pages" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN pages INTEGER DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, file_name)")
+            # 所有进程完成的页数，用于估算整体吞吐量
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS throughput (
+                    finished_at REAL,
+                    pages INTEGER
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_throughput_time ON throughput (finished_at)")
+            self._initialized = True
+        return conn
+
+    def register(self, kind: str, handler):
+        """
+        注册任务处理函数
+        :param kind: 任务类型
+        :param handler: 异步函数，以任务参数作为关键字参数调用
+        """
+        self.handlers[kind] = handler
+
+    def enqueue(self, kind: str, user_id: str, file_name: str, payload: dict, pages: int = 0) -> int:
+        """
+        提交任务，同一文件尚未开始的旧任务会被取消，正在执行的旧任务结束后才会认领新任务
+        :param kind: 任务类型
+        :param user_id:
+        :param file_name: 不带后缀名
+        :param payload: 任务参数
+        :param pages: 文档页数，用于估算积压
+        :return: 任务ID
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("""
+                UPDATE jobs SET status='cancelled', finished_at=?
+                WHERE kind=? AND user_id=? AND file_name=? AND status='queued'
+            """, (now, kind, user_id, file_name))
+            job_id = conn.execute("""
+                INSERT INTO jobs (kind, user_id, file_name, payload, pages, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (kind, user_id, file_name, json.dumps(payload, ensure_ascii=False), pages, now)).lastrowid
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    def cancel_user(self, user_id: str) -> int:
+        """
+        取消用户所有尚未开始的任务
+        :param user_id:
+        :return: 取消的任务数
+        """
+        conn = self.connect()
+        try:
+            return conn.execute("""
+                UPDATE jobs SET status='cancelled', finished_at=? WHERE user_id=? AND status='queued'
+            """, (time.time(), user_id)).rowcount
+        finally:
+            conn.close()
+
+    def claim(self) -> dict or None:
+        """
+        认领任务，用户之间轮流执行
+        :return: 任务记录，没有可执行的任务时返回 None
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            placeholders = ",".join("?" * len(self.handlers))
+            # 优先认领正在执行任务最少的用户的任务，同一用户内按提交顺序；
+            # 同一文件的旧任务仍在执行时不认领，避免两个任务同时写同一份结果
+            row = conn.execute(f"""
+                SELECT id, kind, payload, attempts FROM jobs AS queued
+                WHERE status='queued' AND kind IN ({placeholders})
+                AND NOT EXISTS (
+                    SELECT 1 FROM jobs AS busy
+                    WHERE busy.user_id=queued.user_id AND busy.file_name=queued.file_name AND busy.status='running'
+                )
+                ORDER BY (
+                    SELECT COUNT(*) FROM jobs AS running
+                    WHERE running.user_id=queued.user_id AND running.status='running'
+                ), id LIMIT 1
+            """, tuple(self.handlers)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("""
+                UPDATE jobs SET status='running', worker=?, attempts=attempts+1,
+                started_at=?, heartbeat_at=?, error=NULL
+                WHERE id=?
+            """, (self.worker_id, now, now, row[0]))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1}
+
+    def finish(self, job_id: int, error: str = None):
+        """
+        记录任务结果
+        :param job_id:
+        :param error: 失败原因，None 表示成功
+        """
+        conn = self.connect()
+        try:
+            conn.execute("""
+                UPDATE jobs SET status=?, error=?, finished_at=? WHERE id=? AND worker=?
+            """, ("failed" if error else "done", error, time.time(), job_id, self.worker_id))
+        finally:
+            conn.close()
+
+    def heartbeat(self):
+        """
+        更新本进程正在执行的任务的心跳，并回收心跳超时的任务
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            if self.running:
+                placeholders = ",".join("?" * len(self.running))
+                conn.execute(f"""
+                    UPDATE jobs SET heartbeat_at=? WHERE worker=? AND id IN ({placeholders})
+                """, (now, self.worker_id, *self.running))
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("""
+                UPDATE jobs SET status='failed', error='心跳超时且超过最大执行次数', finished_at=?
+                WHERE status='running' AND heartbeat_at < ? AND attempts >= ?
+            """, (now, now - self.stale_after, self.max_attempts))
+            requeued = conn.execute("""
+                UPDATE jobs SET status='queued', worker=NULL
+                WHERE status='running' AND heartbeat_at < ?
+            """, (now - self.stale_after,)).rowcount
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        if requeued:
+            print(f"回收 {requeued} 个心跳超时的任务")
+            self.requeued += requeued
+            self._wakeup.set()
+
+    def requeue_running(self):
+        """
+        进程正常退出时，把本进程未完成的任务交还给队列，由其他进程立即接手
+        """
+        if not self.running:
+            return
+        conn = self.connect()
+        try:
+            placeholders = ",".join("?" * len(self.running))
+            conn.execute(f"""
+                UPDATE jobs SET status='queued', worker=NULL, attempts=MAX(attempts-1, 0)
+                WHERE worker=? AND status='running' AND id IN ({placeholders})
+            """, (self.worker_id, *self.running))
+        finally:
+            conn.close()
+
+    async def start(self):
+        """
+        启动本进程的消费者和心跳
+        """
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._heartbeat_loop()))
+        print(f"任务队列已启动: {self.worker_id}, 并发数 {self.concurrency}")
+
+    async def stop(self):
+        # 先交还任务再取消，避免取消过程中任务被记为失败
+        self.requeue_running()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _heartbeat_loop(self):
+        while True:
+            try:
+                self.heartbeat()
+            except sqlite3.Error as e:
+                print(f"任务心跳更新失败: {e}")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _consume(self):
+        while True:
+            try:
+                job = self.claim()
+            except sqlite3.Error as e:
+                print(f"任务认领失败: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._execute(job)
+
+    async def _execute(self, job: dict):
+        print(f"开始执行任务 {job['id']}({job['kind']})，第{job['attempts']}次")
+        task = asyncio.create_task(self.handlers[job["kind"]](**job["payload"]))
+        self.running[job["id"]] = task
+        try:
+            await task
+        except asyncio.CancelledError:
+            # 进程退出，任务已交还队列
+            raise
+        except Exception as e:
+            print(f"任务 {job['id']} 执行失败: {e}")
+            self.failed += 1
+            self.finish(job["id"], str(e) or type(e).__name__)
+        else:
+            self.completed += 1
+            self.finish(job["id"])
+        finally:
+            self.running.pop(job["id"], None)
+
+    def record_pages(self, pages: int, window: float):
+        """
+        记录完成的页数，并清理统计窗口之外的记录
+        :param pages:
+        :param window: 统计窗口(秒)
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute("INSERT INTO throughput (finished_at, pages) VALUES (?, ?)", (now, pages))
+            conn.execute("DELETE FROM throughput WHERE finished_at < ?", (now - window,))
+        finally:
+            conn.close()
+
+    def throughput(self, window: float):
+        """
+        所有进程最近一段时间的吞吐量
+        :param window: 统计窗口(秒)
+        :return: (页/秒, 样本覆盖的秒数)，没有记录时为 (0, 0)
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            pages, first = conn.execute("""
+                SELECT SUM(pages), MIN(finished_at) FROM throughput WHERE finished_at >= ?
+            """, (now - window,)).fetchone()
+        finally:
+            conn.close()
+        if not pages:
+            return 0, 0
+        # 刚启动时样本不足一个窗口，按实际覆盖的时间计算，至少按1分钟计，避免偶然的突发
+        span = max(60.0, now - first)
+        return pages / span, now - first
+
+    def backlog_pages(self) -> float:
+        """
+        队列中尚未完成的页数：排队任务按全部页数，执行中的任务不知道进度，按一半估算
+        """
+        conn = self.connect()
+        try:
+            queued, running = conn.execute("""
+                SELECT COALESCE(SUM(CASE WHEN status='queued' THEN pages END), 0),
+                       COALESCE(SUM(CASE WHEN status='running' THEN pages END), 0)
+                FROM jobs WHERE status IN ('queued', 'running')
+            """).fetchone()
+        finally:
+            conn.close()
+        return queued + running / 2
+
+    def user_jobs(self, user_id: str) -> dict:
+        """
+        用户各文件最近一次任务的状态
+        :param user_id:
+        :return: {file_name: {"job_id", "status", "attempts", "error"}}
+        """
+        conn = self.connect()
+        try:
+            rows = conn.execute("""
+                SELECT file_name, id, status, attempts, error FROM jobs
+                WHERE user_id=? AND status != 'cancelled' ORDER BY id
+            """, (user_id,)).fetchall()
+        finally:
+            conn.close()
+        return {
+            row[0]: {"job_id": row[1], "status": row[2], "attempts": row[3], "error": row[4]}
+            for row in rows
+        }
+
+    def stats(self) -> dict:
+        conn = self.connect()
+        try:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = conn.execute("SELECT MIN(created_at) FROM jobs WHERE status='queued'").fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            "worker_id": self.worker_id,
+            "concurrency": self.concurrency,
+            "running": list(self.running),
+            "completed": self.completed,
+            "failed": self.failed,
+            "requeued": self.requeued,
+            "queue": counts,
+            "oldest_queued_age": round(time.time() - oldest, 1) if oldest else None,
+        }
+
+
+job_queue = JobQueue(
+    settings.JOB_DB_PATH,
+    settings.JOB_CONCURRENCY,
+    settings.JOB_HEARTBEAT_INTERVAL,
+    settings.JOB_STALE_AFTER,
+    settings.JOB_MAX_ATTEMPTS,
+    settings.JOB_POLL_INTERVAL,
+)
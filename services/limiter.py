@@ -0,0 +1,139 @@
+import asyncio
+import math
+import time
+from collections import deque
+
+
+class AdaptiveLimiter:
+    """
+    AIMD自适应并发限制：
+    延迟接近基线时加性增加并发上限（每轮约+1），
+    出现超时、429或延迟明显升高时乘性减小；
+    请求耗时包含与输出长度无关的固定开销(图片预填充)，基线按输出长度分组，只与长度相近的请求比较
+    """
+
+    def __init__(self, initial: float, min_limit: float, max_limit: float,
+                 backoff: float = 0.7, tolerance: float = 2.0, history: int = 200):
+        """
+        :param initial: 初始并发上限
+        :param min_limit: 并发上限下限
+        :param max_limit: 并发上限上限
+        :param backoff: 减小时的乘数
+        :param tolerance: 延迟超过基线多少倍视为拥塞
+        :param history: 保留的历史记录条数
+        """
+        self.limit = float(initial)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.in_flight = 0
+        # 各输出长度分组的基线延迟：观测到的最小延迟，缓慢向上漂移以适应负载变化
+        self.baselines = {}
+        self.increases = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._waiters = deque()
+        # (时间, 并发上限, 延迟样本, 事件)
+        self.history = deque(maxlen=history)
+
+    def try_acquire(self) -> bool:
+        """
+        非阻塞占用一个并发名额
+        """
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return True
+        return False
+
+    async def acquire(self):
+        """
+        占用一个并发名额，超出上限时排队等待
+        """
+        if self.try_acquire():
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 已分配名额但调用方被取消，归还名额并交给下一个等待者
+                self.in_flight -= 1
+                self._wake()
+            elif waiter in self._waiters:
+                # 已被 _wake 跳过的取消等待者不在队列中
+                self._waiters.remove(waiter)
+            raise
+
+    @staticmethod
+    def _bucket(size: int) -> int:
+        """
+        输出长度分组，相邻分组的长度相差约1.4倍
+        """
+        return int(math.log2(max(0, size) + 1) * 2)
+
+    def release(self, latency: float = None, overloaded: bool = False, size: int = 0):
+        """
+        归还名额并根据结果调整并发上限
+        :param latency: 本次请求的延迟样本，None 表示不参与调整（如请求参数错误）
+        :param overloaded: 是否出现超时、429等过载信号
+        :param size: 本次请求的输出token数，用于选择基线分组
+        """
+        saturated = self.in_flight >= int(self.limit)
+        self.in_flight -= 1
+        if overloaded:
+            self._decrease(latency, "overload")
+        elif latency is not None:
+            bucket = self._bucket(size)
+            baseline = self.baselines.get(bucket)
+            if baseline is None or latency < baseline:
+                baseline = latency
+            else:
+                baseline += (latency - baseline) * 0.01
+            self.baselines[bucket] = baseline
+            if latency > baseline * self.tolerance:
+                self._decrease(latency, "latency")
+            elif saturated:
+                # 只有并发已用满时才增加，避免空闲时上限无限增长
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.increases += 1
+                self.history.append((time.time(), round(self.limit, 2), latency, "increase"))
+        self._wake()
+
+    def _decrease(self, latency, reason: str):
+        now = time.monotonic()
+        # 同一轮拥塞中的多个失败只减小一次
+        if now - self._last_decrease < max(1.0, min(self.baselines.values(), default=0)):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self.decreases += 1
+        self.history.append((time.time(), round(self.limit, 2), latency, reason))
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "baselines": {
+                f"{2 ** (bucket / 2) - 1:.0f}": round(baseline, 4)
+                for bucket, baseline in sorted(self.baselines.items())
+            },
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "history": [
+                {"time": t, "limit": limit, "latency": latency, "event": event}
+                for t, limit, latency, event in list(self.history)[-50:]
+            ],
+        }
@@ -1,10 +1,25 @@
 # import openai
+import asyncio
 import base64
+import random
+import time
+from collections import deque
 
-from openai import AsyncOpenAI
+from openai import APIConnectionError, APITimeoutError, RateLimitError, APIStatusError
 
 from config.config import settings
-from tenacity import retry, stop_after_attempt, wait_fixed
+from services.balancer import LoadBalancer, Endpoint, parse_endpoints
+from services.limiter import AdaptiveLimiter
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    连接失败、超时、429和5xx可以重试，其余请求错误重试也不会成功
+    """
+    if isinstance(error, (APIConnectionError, RateLimitError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
 
 class ChatService:
     def __init__(self):
@@ -15,6 +30,45 @@ class ChatService:
         self.api_key = settings.VLLM_API_KEY
         self.api_base = settings.VLLM_API_BASE
         self.model = settings.VLLM_MODEL
+        # 进程级自适应并发上限，所有任务共享
+        self.limiter = AdaptiveLimiter(
+            initial=settings.VLM_LIMIT_INITIAL,
+            min_limit=settings.VLM_LIMIT_MIN,
+            max_limit=settings.VLM_MAX_CONCURRENCY,
+            backoff=settings.VLM_LIMIT_BACKOFF,
+            tolerance=settings.VLM_LIMIT_LATENCY_TOLERANCE,
+        )
+        # 最近请求的完整耗时，用于计算对冲触发时间(p95)
+        self.latencies = deque(maxlen=500)
+        # 对冲预算：每个请求积累 VLM_HEDGE_MAX_RATIO 个令牌，每次对冲消耗1个
+        self.hedge_tokens = 0.0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        # 单页/多页合并请求的提示词和输出token，用于比较每页的提示词开销
+        self.usage = {
+            mode: {"requests": 0, "pages": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            for mode in ("single", "batch")
+        }
+        # 合并请求的结果无法按页拆分、改为逐页识别的次数
+        self.batch_fallbacks = 0
+        # 各节点的长连接客户端在应用启动时创建，关闭时释放
+        self.balancer = LoadBalancer([
+            Endpoint(url, weight, self.api_key)
+            for url, weight in parse_endpoints(settings.VLLM_ENDPOINTS or self.api_base)
+        ])
+
+    async def startup(self):
+        """
+        创建各节点共享的客户端及其连接池，启动健康检查
+        """
+        await self.balancer.startup()
+
+    async def close(self):
+        """
+        关闭客户端，释放连接
+        """
+        await self.balancer.close()
 
     async def chat(self, question: str, context: str) -> str:
         """
@@ -26,25 +80,23 @@ class ChatService:
                 {"role": "user", "content": f"上下文信息：\n{context}\n\n用户问题：{question}"}
             ]
 
-            client = AsyncOpenAI(
-                api_key=self.api_key,
-                base_url=self.api_base
-            )
-            response = await client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=2000,
-                timeout=100
-            )
+            async with self.balancer.use() as endpoint:
+                response = await endpoint.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=2000,
+                    timeout=100
+                )
             return response.choices[0].message.content
         except Exception as e:
             raise Exception(f"生成回复失败: {str(e)}")
 
-    # @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-    async def generate_response(self, image_contents: bytes):
+    async def generate_response(self, image_contents: bytes, mime_type: str = "image/jpeg"):
         """
         openai大模型图像识别
+        :param image_contents: 图片字节
+        :param mime_type: 图片类型
         """
         try:
             # 将二进制文件转成字节码
@@ -68,27 +120,198 @@ class ChatService:
                         },
                         {
                             "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
+                            "image_url": {"url": f"data:{mime_type};base64,{base64_image}"},
                         },
                     ],
                 },
             ]
 
-            client = AsyncOpenAI(
-                api_key=self.api_key,
-                base_url=self.api_base
-            )
-            response = await client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.4,
-                max_tokens=4096,
-                timeout=180
-            )
-
+            response = await self._create_with_retry(messages, temperature=0.4, max_tokens=4096)
+            self._record_usage("single", 1, response)
             return response.usage.total_tokens, response.choices[0].message.content
         except Exception as e:
             raise Exception(f"生成回复失败: {str(e)}")
 
+    async def generate_batch_response(self, images: list, max_tokens: int = 8192):
+        """
+        多张图片合并为一次请求，系统提示词只发送一次，要求按页用分隔行输出
+        :param images: [(图片字节, 图片类型)]
+        :param max_tokens: 所有页面合计的输出上限
+        :return: (提示词tokens, 输出tokens, 模型输出, 是否因长度截断)
+        """
+        try:
+            content = [
+                {
+                    "type": "text",
+                    "text": settings.MY_PROMPT_VL_USER.strip() + "\n" + settings.MY_PROMPT_VL_BATCH.format(count=len(images)),
+                },
+            ]
+            for index, (image_contents, mime_type) in enumerate(images, start=1):
+                base64_image = base64.b64encode(image_contents).decode("utf-8")
+                content.append({"type": "text", "text": f"<<<PAGE {index}>>>"})
+                content.append({
+                    "type": "image_url",
+                    "image_url": {"url": f"data:{mime_type};base64,{base64_image}"},
+                })
+            messages = [
+                {
+                    "role": "system",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": settings.MY_PROMPT_VL_SYSTEM,
+                        },
+                    ],
+                },
+                {
+                    "role": "user",
+                    "content": content,
+                },
+            ]
+
+            response = await self._create_with_retry(messages, temperature=0.4, max_tokens=max_tokens)
+            self._record_usage("batch", len(images), response)
+            choice = response.choices[0]
+            return (response.usage.prompt_tokens, response.usage.completion_tokens, choice.message.content,
+                    choice.finish_reason == "length")
+        except Exception as e:
+            raise Exception(f"生成回复失败: {str(e)}")
+
+    def _record_usage(self, mode: str, pages: int, response):
+        usage = self.usage[mode]
+        usage["requests"] += 1
+        usage["pages"] += pages
+        usage["prompt_tokens"] += response.usage.prompt_tokens or 0
+        usage["completion_tokens"] += response.usage.completion_tokens or 0
+
+    async def _create_with_retry(self, messages: list, **kwargs):
+        """
+        带截止时间的重试：指数退避加随机抖动，剩余时间不足以再等一次时直接放弃，
+        每次请求的超时不超过剩余时间
+        :param messages:
+        :param kwargs: 透传给 chat.completions.create
+        :return: 模型响应
+        """
+        deadline = time.monotonic() + settings.VLM_REQUEST_DEADLINE
+        attempt = 0
+        while True:
+            attempt += 1
+            remaining = deadline - time.monotonic()
+            try:
+                return await self._hedged_create(messages, timeout=min(180, remaining), **kwargs)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= settings.VLM_RETRY_ATTEMPTS:
+                    raise
+                # full jitter：在 [0, 基础退避 * 2^n] 内随机等待
+                wait = random.uniform(0, min(settings.VLM_RETRY_BACKOFF_MAX, settings.VLM_RETRY_BACKOFF * 2 ** attempt))
+                if time.monotonic() + wait + 1 >= deadline:
+                    raise
+                self.retries += 1
+                print(f"模型调用失败，{wait:.1f}秒后第{attempt}次重试: {e}")
+                await asyncio.sleep(wait)
+
+    async def _hedged_create(self, messages: list, **kwargs):
+        """
+        对冲请求：超过p95耗时仍未返回时，向另一个节点发送相同请求，取先成功的结果；
+        对冲次数受 VLM_HEDGE_MAX_RATIO 限制
+        :param messages:
+        :param kwargs:
+        :return: 模型响应
+        """
+        self.hedge_tokens = min(10.0, self.hedge_tokens + settings.VLM_HEDGE_MAX_RATIO)
+        tried = []
+        primary = asyncio.create_task(self._limited_create(messages, tried=tried, **kwargs))
+        delay = self.hedge_delay()
+        if delay is None or len(self.balancer.endpoints) < 2:
+            return await self._timed(primary)
+        start = time.perf_counter()
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or self.hedge_tokens < 1:
+            return await self._timed(primary, start)
+        self.hedge_tokens -= 1
+        self.hedges += 1
+        hedge = asyncio.create_task(self._limited_create(messages, exclude=tuple(tried), **kwargs))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        self.latencies.append(time.perf_counter() - start)
+                        return task.result()
+            # 两个请求都失败，抛出原始请求的异常
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _timed(self, task: asyncio.Task, start: float = None):
+        start = start or time.perf_counter()
+        response = await task
+        self.latencies.append(time.perf_counter() - start)
+        return response
+
+    def hedge_delay(self) -> float or None:
+        """
+        对冲触发时间：最近请求耗时的p95，样本不足或未开启时返回 None
+        """
+        if not settings.VLM_HEDGE_ENABLED or len(self.latencies) < 20:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[int(len(latencies) * 0.95) - 1]
+
+    def request_stats(self) -> dict:
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1) if self.hedge_delay() else None,
+            "hedge_tokens": round(self.hedge_tokens, 2),
+            "batch_fallbacks": self.batch_fallbacks,
+            "usage": {
+                mode: dict(
+                    usage,
+                    prompt_tokens_per_page=round(usage["prompt_tokens"] / usage["pages"], 1) if usage["pages"] else None,
+                )
+                for mode, usage in self.usage.items()
+            },
+        }
+
+    async def _limited_create(self, messages: list, tried: list = None, exclude=(), **kwargs):
+        """
+        在自适应并发限制下调用模型，并把延迟和过载信号反馈给限流器
+        延迟样本取整个请求的耗时，并附带输出token数，由限流器与输出长度相近的请求比较
+        :param messages:
+        :param tried: 记录本次使用的节点
+        :param exclude: 不使用的节点
+        :param kwargs: 透传给 chat.completions.create
+        :return: 模型响应
+        """
+        await self.limiter.acquire()
+        latency, overloaded, size = None, False, 0
+        try:
+            start = time.perf_counter()
+            async with self.balancer.use(exclude) as endpoint:
+                if tried is not None:
+                    tried.append(endpoint)
+                response = await endpoint.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **kwargs
+                )
+            latency = time.perf_counter() - start
+            size = response.usage.completion_tokens or 0
+            return response
+        except (APITimeoutError, RateLimitError):
+            overloaded = True
+            raise
+        except APIStatusError as e:
+            overloaded = e.status_code == 503
+            raise
+        finally:
+            self.limiter.release(latency, overloaded, size)
+
 
 chat_service = ChatService()
@@ -0,0 +1,144 @@
+import asyncio
+import io
+import re
+
+from PIL import Image
+
+from config.config import settings
+from core.executor import image_pool
+from core.tools import downscale_image
+from services.llm import chat_service
+from services.scheduler import page_scheduler
+
+PAGE_DELIMITER = re.compile(r"^[ \t]*<<<PAGE (\d+)>>>[ \t]*$", re.MULTILINE)
+
+
+def image_pixels(image_contents: bytes) -> int:
+    """
+    图片像素数，只读取文件头
+    :param image_contents:
+    :return:
+    """
+    with Image.open(io.BytesIO(image_contents)) as image:
+        return image.width * image.height
+
+
+def split_pages(content: str, count: int) -> list or None:
+    """
+    按 <<<PAGE n>>> 分隔行拆分合并请求的输出
+    :param content: 模型输出
+    :param count: 页数
+    :return: 每页的markdown，页码缺失、重复或乱序时返回 None
+    """
+    matches = list(PAGE_DELIMITER.finditer(content))
+    if [int(match.group(1)) for match in matches] != list(range(1, count + 1)):
+        return None
+    pages = []
+    for index, match in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(content)
+        pages.append(content[match.end():end].strip("\n") + "\n")
+    return pages
+
+
+class PageBatcher:
+    """
+    单个任务内的多页合并：每页先缩小到单页像素上限，等待中的页面凑满页数/像素/token预算或等待超时后，
+    合并为一次多图请求，再把输出按页拆分；拆分失败时逐页重新识别
+    """
+
+    def __init__(self, user_id: str, lane: str = "batch"):
+        """
+        :param user_id: 调度时按用户排队
+        :param lane: 优先级通道
+        """
+        self.user_id = user_id
+        self.lane = lane
+        # 等待合并的页面 [(图片字节, 图片类型, 估算的图片token, 像素数, future)]
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+
+    async def submit(self, image_contents: bytes, mime_type: str = "image/jpeg"):
+        """
+        提交一页，等待所在批次完成
+        :param image_contents:
+        :param mime_type:
+        :return: (分摊到本页的tokens, markdown)
+        """
+        pixels = image_pixels(image_contents)
+        if pixels > settings.VLM_BATCH_PAGE_MAX_PIXELS:
+            # 300dpi渲染的整页图片单张就接近token预算，墨迹较少的页面缩小后仍能清晰识别
+            image_contents = await image_pool.run(downscale_image, image_contents, settings.VLM_BATCH_PAGE_MAX_PIXELS)
+            mime_type = "image/jpeg"
+            pixels = image_pixels(image_contents)
+        tokens = pixels / settings.VLM_PIXELS_PER_TOKEN
+        if tokens > settings.VLM_BATCH_MAX_TOKENS or pixels > settings.VLM_BATCH_MAX_PIXELS:
+            # 单页已超出预算，直接单独识别
+            return await self._single(image_contents, mime_type)
+        if self.pending and (
+            sum(item[2] for item in self.pending) + tokens > settings.VLM_BATCH_MAX_TOKENS
+            or sum(item[3] for item in self.pending) + pixels > settings.VLM_BATCH_MAX_PIXELS
+        ):
+            self._flush()
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((image_contents, mime_type, tokens, pixels, future))
+        if len(self.pending) >= settings.VLM_BATCH_MAX_PAGES:
+            self._flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(settings.VLM_BATCH_LINGER, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, batch: list):
+        futures = [item[4] for item in batch]
+        try:
+            if len(batch) == 1:
+                results = [await self._single(batch[0][0], batch[0][1])]
+            else:
+                results = await self._batch(batch)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _batch(self, batch: list) -> list:
+        """
+        合并请求：提示词tokens按页平均分摊，输出tokens按各页输出长度分摊
+        :param batch:
+        :return: [(tokens, markdown)]
+        """
+        images = [(item[0], item[1]) for item in batch]
+        async with page_scheduler.slot(self.user_id, self.lane, cost=len(batch)):
+            prompt_tokens, completion_tokens, content, truncated = await chat_service.generate_batch_response(
+                images, settings.VLM_BATCH_MAX_OUTPUT_TOKENS
+            )
+        pages = None if truncated else split_pages(content, len(batch))
+        if pages is None:
+            print(f"合并请求的输出无法按页拆分，{len(batch)}页改为逐页识别")
+            chat_service.batch_fallbacks += 1
+            results = await asyncio.gather(*(self._single(image, mime_type) for image, mime_type in images))
+            # 合并请求已消耗的token计入第一页
+            return [(tokens + (prompt_tokens + completion_tokens if index == 0 else 0), markdown)
+                    for index, (tokens, markdown) in enumerate(results)]
+        total_chars = sum(len(page) for page in pages) or 1
+        shares = [round(prompt_tokens / len(pages) + completion_tokens * len(page) / total_chars) for page in pages]
+        # 取整误差计入最后一页，各页合计等于实际消耗
+        shares[-1] += prompt_tokens + completion_tokens - sum(shares)
+        return list(zip(shares, pages))
+
+    async def _single(self, image_contents: bytes, mime_type: str):
+        async with page_scheduler.slot(self.user_id, self.lane):
+            return await chat_service.generate_response(image_contents, mime_type)
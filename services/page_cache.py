@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+
+from config.config import settings
+from services.llm import chat_service
+from services.scheduler import page_scheduler
+
+
+class PageCache:
+    """
+    单页识别结果缓存：以压缩后的页面图片+提示词+模型为键，命中时跳过模型调用；
+    持久化到SQLite，支持容量上限(LRU淘汰)和过期时间
+    """
+
+    def __init__(self, db_path: str, max_entries: int, ttl: float):
+        """
+        :param db_path: 缓存数据库路径
+        :param max_entries: 最多缓存的页数
+        :param ttl: 过期时间(秒)，0 为不过期
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._initialized = False
+
+    def connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if not self._initialized:
+            # WAL 模式允许多个 uvicorn 进程同时读写
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    key TEXT PRIMARY KEY,
+                    markdown TEXT,
+                    tokens INTEGER DEFAULT 0,
+                    created_at REAL,
+                    accessed_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_accessed ON pages (accessed_at)")
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def key(self, image_contents: bytes) -> str:
+        digest = hashlib.sha256(image_contents)
+        for part in (settings.MY_PROMPT_VL_SYSTEM, settings.MY_PROMPT_VL_USER, settings.VLLM_MODEL):
+            digest.update(b"\x00" + part.encode("utf-8"))
+        return digest.hexdigest()
+
+    async def get(self, key: str) -> tuple or None:
+        """
+        在线程中查询，避免 SQLite 读写阻塞事件循环
+        :param key:
+        :return: (tokens, markdown)，未命中或已过期返回 None
+        """
+        row = await asyncio.to_thread(self._get, key)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row
+
+    async def put(self, key: str, tokens: int, markdown: str):
+        self.evictions += await asyncio.to_thread(self._put, key, tokens, markdown)
+
+    def _get(self, key: str) -> tuple or None:
+        now = time.time()
+        conn = self.connect()
+        try:
+            row = conn.execute("SELECT markdown, tokens, created_at FROM pages WHERE key=?", (key,)).fetchone()
+            if row is None or (self.ttl and now - row[2] > self.ttl):
+                return None
+            conn.execute("UPDATE pages SET accessed_at=? WHERE key=?", (now, key))
+            conn.commit()
+        finally:
+            conn.close()
+        return row[1], row[0]
+
+    def _put(self, key: str, tokens: int, markdown: str) -> int:
+        """
+        :return: 淘汰的记录数
+        """
+        now = time.time()
+        evictions = 0
+        conn = self.connect()
+        try:
+            conn.execute("""
+                INSERT OR REPLACE INTO pages (key, markdown, tokens, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (key, markdown, tokens, now, now))
+            if self.ttl:
+                evictions += conn.execute("DELETE FROM pages WHERE created_at < ?", (now - self.ttl,)).rowcount
+            # 超出容量时删除最久未使用的记录
+            evictions += conn.execute("""
+                DELETE FROM pages WHERE key IN (
+                    SELECT key FROM pages ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return evictions
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+        }
+
+
+page_cache = PageCache(f"{settings.CACHE_DIR}/pages.db", settings.PAGE_CACHE_MAX_ENTRIES, settings.PAGE_CACHE_TTL)
+
+
+async def cached_generate_response(image_contents: bytes, mime_type: str = "image/jpeg", user_id: str = "",
+                                   lane: str = "batch", batcher=None):
+    """
+    先查单页缓存，未命中再经公平调度后调用视觉模型并写入缓存
+    :param image_contents:
+    :param mime_type:
+    :param user_id: 调度时按用户排队
+    :param lane: 优先级通道，interactive 或 batch
+    :param batcher: PageBatcher，传入时与其他页面合并为一次请求
+    :return: (本次消耗的tokens, markdown, 缓存命中时原本消耗的tokens 或 None)
+    """
+    if not settings.PAGE_CACHE_ENABLED:
+        tokens, markdown = await _generate(image_contents, mime_type, user_id, lane, batcher)
+        return tokens, markdown, None
+    key = page_cache.key(image_contents)
+    cached = await page_cache.get(key)
+    if cached is not None:
+        return 0, cached[1], cached[0]
+    tokens, markdown = await _generate(image_contents, mime_type, user_id, lane, batcher)
+    await page_cache.put(key, tokens, markdown)
+    return tokens, markdown, None
+
+
+async def _generate(image_contents: bytes, mime_type: str, user_id: str, lane: str, batcher):
+    if batcher is not None:
+        return await batcher.submit(image_contents, mime_type)
+    async with page_scheduler.slot(user_id, lane):
+        return await chat_service.generate_response(image_contents, mime_type)
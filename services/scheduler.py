@@ -0,0 +1,265 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from config.config import settings
+from services.llm import chat_service
+
+
+def parse_weights(value: str) -> dict:
+    """
+    解析用户权重配置："user1|2,user2|3"，未配置的用户权重为1
+    :param value:
+    :return: {user_id: weight}
+    """
+    weights = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        user_id, _, weight = item.partition("|")
+        weights[user_id.strip()] = float(weight) if weight else 1.0
+    return weights
+
+
+class Lane:
+    """
+    一个优先级通道：每个用户一个等待队列，按赤字轮询(DRR)依次放行
+    """
+
+    def __init__(self, name: str, quantum: float, user_max_in_flight: int, weights: dict, window: int):
+        self.name = name
+        self.quantum = quantum
+        self.user_max_in_flight = user_max_in_flight
+        self.weights = weights
+        # 每个用户的等待队列 [(future, cost, 入队时间)]
+        self.queues = {}
+        # 有请求等待的用户，队首为当前轮到的用户
+        self.active = deque()
+        self.deficit = {}
+        self.in_flight = {}
+        self.total_in_flight = 0
+        self.dispatched = {}
+        self.waits = {}
+        # 本通道最近的排队等待时间和总耗时（排队+执行）
+        self.lane_waits = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+        self.window = window
+        self._turn_open = False
+
+    def push(self, user_id: str, future, cost: float):
+        queue = self.queues.setdefault(user_id, deque())
+        if not queue:
+            self.active.append(user_id)
+            self.deficit[user_id] = 0
+        queue.append((future, cost, time.monotonic()))
+
+    def remove(self, user_id: str, future):
+        queue = self.queues[user_id]
+        for item in queue:
+            if item[0] is future:
+                queue.remove(item)
+                if not queue:
+                    self._deactivate(user_id)
+                break
+
+    def _deactivate(self, user_id: str):
+        if self.active and self.active[0] == user_id:
+            self._turn_open = False
+        self.active.remove(user_id)
+        self.deficit[user_id] = 0
+
+    def _next_turn(self):
+        self.active.rotate(-1)
+        self._turn_open = False
+
+    def _capped(self, user_id: str) -> bool:
+        return 0 < self.user_max_in_flight <= self.in_flight.get(user_id, 0)
+
+    def ready(self) -> bool:
+        """
+        是否有未达到在途上限的用户在等待
+        """
+        return any(not self._capped(user_id) for user_id in self.active)
+
+    def pop(self) -> bool:
+        """
+        按DRR放行一个请求
+        :return: 是否放行成功
+        """
+        if not self.ready():
+            return False
+        while True:
+            user_id = self.active[0]
+            if self._capped(user_id):
+                self._next_turn()
+                continue
+            if not self._turn_open:
+                # 新一轮开始，按权重增加配额
+                self.deficit[user_id] += self.quantum * self.weights.get(user_id, 1.0)
+                self._turn_open = True
+            queue = self.queues[user_id]
+            # 排队中被取消的请求直接丢弃，不扣配额也不计入在途
+            while queue and queue[0][0].done():
+                queue.popleft()
+            if not queue:
+                self._deactivate(user_id)
+                if not self.ready():
+                    return False
+                continue
+            future, cost, enqueued_at = queue[0]
+            if self.deficit[user_id] < cost:
+                self._next_turn()
+                continue
+            queue.popleft()
+            self.deficit[user_id] -= cost
+            self.in_flight[user_id] = self.in_flight.get(user_id, 0) + 1
+            self.total_in_flight += 1
+            self.dispatched[user_id] = self.dispatched.get(user_id, 0) + 1
+            wait = time.monotonic() - enqueued_at
+            self.waits.setdefault(user_id, deque(maxlen=self.window)).append(wait)
+            self.lane_waits.append(wait)
+            future.set_result(None)
+            if not queue:
+                self._deactivate(user_id)
+            return True
+
+    def release(self, user_id: str, latency: float = None):
+        self.in_flight[user_id] -= 1
+        self.total_in_flight -= 1
+        if latency is not None:
+            self.latencies.append(latency)
+
+    def stats(self) -> dict:
+        users = {}
+        for user_id in set(self.queues) | set(self.in_flight):
+            waits = sorted(self.waits.get(user_id, ()))
+            users[user_id] = {
+                "queued": len(self.queues.get(user_id, ())),
+                "in_flight": self.in_flight.get(user_id, 0),
+                "dispatched": self.dispatched.get(user_id, 0),
+                "weight": self.weights.get(user_id, 1.0),
+                "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else None,
+                "wait_p95_ms": _percentile_ms(waits, 0.95),
+                "wait_max_ms": round(waits[-1] * 1000, 1) if waits else None,
+            }
+        waits = sorted(self.lane_waits)
+        latencies = sorted(self.latencies)
+        return {
+            "queued": sum(len(queue) for queue in self.queues.values()),
+            "in_flight": self.total_in_flight,
+            "user_max_in_flight": self.user_max_in_flight,
+            "wait_ms": {f"p{int(q * 100)}": _percentile_ms(waits, q) for q in (0.5, 0.95, 0.99)},
+            "latency_ms": {f"p{int(q * 100)}": _percentile_ms(latencies, q) for q in (0.5, 0.95, 0.99)},
+            "users": users,
+        }
+
+
+def _percentile_ms(samples: list, q: float):
+    """
+    :param samples: 已排序的样本(秒)
+    :param q: 分位数
+    :return: 毫秒，无样本时为 None
+    """
+    if not samples:
+        return None
+    return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 1)
+
+
+class FairScheduler:
+    """
+    优先级通道 + 跨用户公平调度：
+    交互通道(单张图片识别)优先于批量通道(PDF页面)，但批量通道在有请求等待时
+    至少保有 batch_min_share 比例的并发，不会被交互请求完全饿死；
+    每个通道内按用户做赤字轮询，并限制单个用户的在途请求数
+    """
+
+    def __init__(self, capacity, quantum: float = 1, user_max_in_flight: int = 0,
+                 weights: dict = None, batch_min_share: float = 0.2, window: int = 200):
+        """
+        :param capacity: 返回当前总并发上限的函数
+        :param quantum: 每轮为用户增加的配额（乘以权重）
+        :param user_max_in_flight: 批量通道单个用户的在途上限，0 为不限制
+        :param weights: 用户权重
+        :param batch_min_share: 批量通道保底的并发比例
+        :param window: 保留的等待时间样本数
+        """
+        self.capacity = capacity
+        self.batch_min_share = batch_min_share
+        weights = weights or {}
+        # 按优先级从高到低排列
+        self.lanes = {
+            "interactive": Lane("interactive", quantum, 0, weights, window),
+            "batch": Lane("batch", quantum, user_max_in_flight, weights, window),
+        }
+        self.total_in_flight = 0
+
+    @asynccontextmanager
+    async def slot(self, user_id: str, lane: str = "batch", cost: float = 1):
+        """
+        等待轮到该用户后执行，退出时归还名额
+        :param user_id:
+        :param lane: interactive 或 batch
+        :param cost: 本次请求的开销，页面请求为1
+        """
+        start = time.monotonic()
+        await self.acquire(user_id, lane, cost)
+        try:
+            yield
+        finally:
+            self.release(user_id, lane, time.monotonic() - start)
+
+    async def acquire(self, user_id: str, lane: str = "batch", cost: float = 1):
+        future = asyncio.get_running_loop().create_future()
+        self.lanes[lane].push(user_id, future, cost)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已放行但调用方被取消，归还名额
+                self.release(user_id, lane, None)
+            else:
+                self.lanes[lane].remove(user_id, future)
+            raise
+
+    def release(self, user_id: str, lane: str = "batch", latency: float = None):
+        self.lanes[lane].release(user_id, latency)
+        self.total_in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        interactive, batch = self.lanes["interactive"], self.lanes["batch"]
+        while self.total_in_flight < self.capacity():
+            capacity = self.capacity()
+            # 批量通道低于保底份额时优先放行，否则交互通道优先
+            if batch.ready() and batch.total_in_flight < max(1, int(capacity * self.batch_min_share)):
+                order = (batch, interactive)
+            else:
+                order = (interactive, batch)
+            if not any(lane.pop() for lane in order):
+                break
+            self.total_in_flight += 1
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity(),
+            "in_flight": self.total_in_flight,
+            "batch_min_share": self.batch_min_share,
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()},
+        }
+
+
+def _vlm_capacity() -> int:
+    # 跟随自适应并发限制，排队发生在调度器而不是限流器中
+    return max(1, int(chat_service.limiter.limit))
+
+
+page_scheduler = FairScheduler(
+    _vlm_capacity,
+    quantum=settings.FAIR_QUANTUM,
+    user_max_in_flight=settings.FAIR_USER_MAX_IN_FLIGHT,
+    weights=parse_weights(settings.FAIR_USER_WEIGHTS),
+    batch_min_share=settings.BATCH_MIN_SHARE,
+)
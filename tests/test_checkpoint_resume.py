@@ -0,0 +1,88 @@
+import asyncio
+import importlib.util
+import sys
+import types
+
+import fitz
+import pytest
+
+from config.config import settings
+from services.db_token import db
+from services.job_queue import job_queue
+from services.llm import chat_service
+
+if importlib.util.find_spec("marker") is None:
+    # 本测试不走marker引擎，未安装marker时用空模块代替，只为能导入 core.file
+    marker_stub = types.ModuleType("core.marker_pdf")
+    marker_stub.marker_pool = None
+    sys.modules.setdefault("core.marker_pdf", marker_stub)
+
+from core import file as core_file  # noqa: E402
+from core.manifest import read_manifest  # noqa: E402
+
+
+def _make_pdf(path: str):
+    """
+    5页、每页都需要视觉模型，第2、3页内容完全相同(页面指纹相同，第3页为重复页)
+    """
+    document = fitz.open()
+    for label in ("A", "B", "B", "C", "D"):
+        page = document.new_page()
+        page.insert_text((72, 72), f"Figure {label}", fontsize=11)
+        page.draw_rect(fitz.Rect(72, 100, 72 + 40 * (ord(label) - 64), 300), color=(0, 0, 0), fill=(0.5, 0.5, 0.5))
+    document.save(path)
+    document.close()
+
+
+@pytest.fixture
+def job(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+    # 完成页数会写入任务队列的吞吐量表，队列数据库放到临时目录
+    monkeypatch.setattr(settings, "JOB_DB_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(job_queue, "db_path", settings.JOB_DB_PATH)
+    monkeypatch.setattr(job_queue, "_initialized", False)
+    for name in ("DOC_CACHE_ENABLED", "PAGE_CACHE_ENABLED", "VLM_BATCH_ENABLED"):
+        monkeypatch.setattr(settings, name, False)
+    # 按页码顺序识别，第3页为重复页不调用模型，第4次调用对应第5页
+    monkeypatch.setattr(settings, "PDF_PAGE_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "PDF_PIPELINE_WORKERS", 1)
+
+    async def create_token_record(user_id, file_name, total_tokens=0):
+        pass
+
+    monkeypatch.setattr(db, "create_token_record", create_token_record)
+    upload_dir = tmp_path / "resume" / "upload"
+    upload_dir.mkdir(parents=True)
+    (tmp_path / "resume" / "result").mkdir()
+    path = str(upload_dir / "doc.pdf")
+    _make_pdf(path)
+    return path
+
+
+def test_resume_keeps_pages_with_identical_fingerprints(job, monkeypatch):
+    calls = []
+    fail = {"call": 4}
+
+    async def generate_response(image_contents, mime_type="image/jpeg"):
+        calls.append(len(calls) + 1)
+        if len(calls) == fail["call"]:
+            raise Exception("模型调用失败")
+        return 100, f"page-{len(calls)}\n"
+
+    monkeypatch.setattr(chat_service, "generate_response", generate_response)
+    with pytest.raises(Exception):
+        asyncio.run(core_file.pdf_ocr_service(job, "resume"))
+    assert len(calls) == 4
+
+    fail["call"] = None
+    asyncio.run(core_file.pdf_ocr_service(job, "resume"))
+    # 只有第5页重新识别
+    assert len(calls) == 5
+
+    manifest = read_manifest("resume", "doc")
+    pages = manifest["pages"]
+    assert [page["engine"] for page in pages] == ["vlm", "vlm", "duplicate", "vlm", "vlm"]
+    assert pages[2]["duplicate_of"] == 1
+    assert [page["tokens"] for page in pages] == [100, 100, 0, 100, 100]
+    assert [page.get("resumed", False) for page in pages] == [True, True, True, True, False]
+    assert manifest["total_tokens"] == 400
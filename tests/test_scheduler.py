@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from services.scheduler import FairScheduler
+
+
+def test_release_skips_waiter_cancelled_while_queued():
+    async def main():
+        scheduler = FairScheduler(lambda: 1)
+        lane = scheduler.lanes["batch"]
+        await scheduler.acquire("a")
+        cancelled = asyncio.create_task(scheduler.acquire("b"))
+        waiting = asyncio.create_task(scheduler.acquire("c"))
+        await asyncio.sleep(0)
+        # 取消时 future 立即被取消，等待者的异常处理要到下一轮事件循环才执行
+        cancelled.cancel()
+        scheduler.release("a")
+        await waiting
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert scheduler.total_in_flight == lane.total_in_flight == 1
+        assert lane.in_flight == {"a": 0, "c": 1}
+        assert list(lane.active) == []
+        scheduler.release("c")
+        assert scheduler.total_in_flight == lane.total_in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_release_with_only_cancelled_waiters_keeps_slot_free():
+    async def main():
+        scheduler = FairScheduler(lambda: 1)
+        lane = scheduler.lanes["batch"]
+        await scheduler.acquire("a")
+        cancelled = asyncio.create_task(scheduler.acquire("a"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        scheduler.release("a")
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert scheduler.total_in_flight == lane.total_in_flight == 0
+        assert list(lane.active) == [] and not lane.queues["a"]
+        # 名额可以再次分配
+        await asyncio.wait_for(scheduler.acquire("b"), 1)
+        assert lane.in_flight["b"] == 1
+
+    asyncio.run(main())